@@ -0,0 +1,21 @@
+import asyncio
+import weakref
+
+
+class LoopLocal:
+    # Async clients and connection pools belong to the event loop that created them, so the
+    # sync entry points (each with their own asyncio.run) get a fresh instance per loop.
+    def __init__(self, factory):
+        self.factory = factory
+        self._values = weakref.WeakKeyDictionary()
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        value = self._values.get(loop)
+        if value is None:
+            value = self.factory()
+            self._values[loop] = value
+        return value
+
+    def pop(self):
+        return self._values.pop(asyncio.get_running_loop(), None)
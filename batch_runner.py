@@ -0,0 +1,189 @@
+import asyncio
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+import instrumentation
+from instrumentation import span
+from http_session import close_http_session
+from run_manifest import RunManifest, new_run_id
+from results_store import ResultsStore
+from windsurf_finder import WindsurfFinder
+from windsurf_website_analyzer import WindsurfWebsiteAnalyzer
+from windsurf_data_aggregator import WindsurfDataAggregator
+
+
+class BatchRunner:
+    # Runs many areas as one job. Every area's search starts at once and each domain flows on to
+    # analysis and aggregation as soon as it is found, so the shared provider limiters always have
+    # work queued. A domain found in several areas (chains, national booking sites) is analyzed
+    # and aggregated once and its record is reused for every area that found it.
+    def __init__(self, manifest=None, refresh=False, results_store=None):
+        self.manifest = manifest
+        self.results_store = results_store
+        self.finder = WindsurfFinder(manifest=manifest)
+        self.analyzer = WindsurfWebsiteAnalyzer(manifest=manifest)
+        self.aggregator = WindsurfDataAggregator(manifest=manifest, refresh=refresh, results_store=results_store)
+        self.stats = Counter()
+
+    async def _process_domain(self, domain, urls):
+        _, categories = await self.analyzer._process_domain(domain, urls)
+        if not categories:
+            return None
+        return await self.aggregator.aggregate_domain(domain, categories)
+
+    async def run(self, areas):
+        domain_tasks = {}
+        area_domains = {}
+
+        async def _find(area):
+            area_domains[area] = []
+            with span("stage:find", area=area):
+                async for domain, urls in self.finder.iter_windsurf_locations(area):
+                    area_domains[area].append(domain)
+                    if self.results_store:
+                        self.results_store.add_region(area, domain)
+                    if domain in domain_tasks:
+                        self.stats["shared_domains"] += 1
+                        continue
+                    domain_tasks[domain] = asyncio.ensure_future(self._process_domain(domain, urls))
+
+        try:
+            await asyncio.gather(*(_find(area) for area in areas))
+            self.stats["areas"] = len(areas)
+            self.stats["domains"] = len(domain_tasks)
+            domain_results = dict(zip(domain_tasks, await asyncio.gather(*domain_tasks.values())))
+        finally:
+            for task in domain_tasks.values():
+                if not task.done():
+                    task.cancel()
+
+        self.report()
+        return {
+            area: {domain: domain_results[domain] for domain in area_domains.get(area, []) if domain_results.get(domain) is not None}
+            for area in areas
+        }
+
+    async def stream(self, areas):
+        # Yields (area, domain, record) as soon as each domain's record is ready, in completion
+        # order, instead of returning everything at the end. Records are only held on to while
+        # areas are still being searched, in case another area finds the same domain later.
+        queue = asyncio.Queue()
+        domain_tasks = {}
+        domain_areas = defaultdict(list)
+        finished = {}
+        searching = True
+
+        async def _process(domain, urls):
+            record = await self._process_domain(domain, urls)
+            if searching:
+                finished[domain] = record
+            for area in domain_areas[domain]:
+                queue.put_nowait((area, domain, record))
+
+        async def _find(area):
+            with span("stage:find", area=area):
+                async for domain, urls in self.finder.iter_windsurf_locations(area):
+                    if self.results_store:
+                        self.results_store.add_region(area, domain)
+                    domain_areas[domain].append(area)
+                    if domain in domain_tasks:
+                        self.stats["shared_domains"] += 1
+                        if domain in finished:
+                            queue.put_nowait((area, domain, finished[domain]))
+                        continue
+                    domain_tasks[domain] = asyncio.ensure_future(_process(domain, urls))
+
+        async def _run():
+            nonlocal searching
+            try:
+                await asyncio.gather(*(_find(area) for area in areas))
+                searching = False
+                finished.clear()
+                self.stats["areas"] = len(areas)
+                self.stats["domains"] = len(domain_tasks)
+                await asyncio.gather(*domain_tasks.values())
+            finally:
+                queue.put_nowait(None)
+
+        runner = asyncio.ensure_future(_run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if item[2] is not None:
+                    yield item
+            # Re-raises the error that ended the run early, if any.
+            await runner
+        finally:
+            runner.cancel()
+            for task in domain_tasks.values():
+                if not task.done():
+                    task.cancel()
+        self.report()
+
+    def report(self):
+        self.analyzer.pre_classifier.report()
+        self.analyzer.pre_classifier.save()
+        self.aggregator.report()
+        print(f"Batch: {json.dumps(dict(self.stats))}")
+
+
+async def run_batch(areas, run_id=None, refresh=False):
+    # Like run_pipeline, but for many areas at once.
+    areas = list(dict.fromkeys(areas))
+    if run_id is None:
+        run_id = new_run_id("batch:" + "|".join(areas) + (":refresh" if refresh else ""))
+    print(f"Run id: {run_id}")
+    manifest = RunManifest(run_id)
+    results_store = ResultsStore()
+    try:
+        with span("stage:batch", areas=len(areas)):
+            return await BatchRunner(manifest=manifest, refresh=refresh, results_store=results_store).run(areas)
+    finally:
+        print(f"Run manifest: {json.dumps(manifest.summary())}")
+        results_store.close()
+        await close_http_session()
+        instrumentation.export()
+
+async def stream_batch(areas, output, run_id=None, refresh=False):
+    # Streaming counterpart of run_batch: writes one JSON line per (area, domain) record to output
+    # (a path or an open text file) as soon as the record is ready, and returns the line count.
+    areas = list(dict.fromkeys(areas))
+    if run_id is None:
+        run_id = new_run_id("batch:" + "|".join(areas) + (":refresh" if refresh else ""))
+    print(f"Run id: {run_id}")
+    manifest = RunManifest(run_id)
+    results_store = ResultsStore()
+    started = time.perf_counter()
+    lines = 0
+    out = open(output, "a", encoding="utf-8") if isinstance(output, str) else output
+    try:
+        with span("stage:batch", areas=len(areas), streaming=True):
+            async for area, domain, record in BatchRunner(manifest=manifest, refresh=refresh, results_store=results_store).stream(areas):
+                out.write(json.dumps({"area": area, "domain": domain, "record": record}, ensure_ascii=False) + "\n")
+                out.flush()
+                if not lines:
+                    print(f"First record after {time.perf_counter() - started:.2f}s")
+                lines += 1
+        return lines
+    finally:
+        if out is not output:
+            out.close()
+        print(f"Run manifest: {json.dumps(manifest.summary())}")
+        results_store.close()
+        await close_http_session()
+        instrumentation.export()
+
+if __name__ == '__main__':
+    # Areas come from the command line, e.g. python batch_runner.py Lanzarote Fuerteventura Tarifa
+    # With --jsonl=PATH records are appended to PATH as they finish instead of printed at the end.
+    areas = [arg for arg in sys.argv[1:] if not arg.startswith("--")] or ["Lanzarote", "Fuerteventura"]
+    jsonl = next((arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--jsonl=")), None)
+    if jsonl:
+        lines = asyncio.run(stream_batch(areas, jsonl, refresh="--refresh" in sys.argv))
+        print(f"Wrote {lines} records to {jsonl}")
+    else:
+        results = asyncio.run(run_batch(areas, refresh="--refresh" in sys.argv))
+        print(json.dumps(results, indent=4))
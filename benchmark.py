@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import tempfile
+import time
+from fake_servers import FakeProviderServers
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percentile - 1]
+
+
+def _configure_environment(servers, cache_dir, args):
+    os.environ.update({
+        "GROQ_API_KEY": "benchmark",
+        "TAVILY_API_KEY": "benchmark",
+        "GROQ_BASE_URL": servers.api_url,
+        "TAVILY_BASE_URL": servers.api_url,
+        "CACHE_DIR": cache_dir,
+        "RESULTS_DB_PATH": os.path.join(cache_dir, "results.sqlite3"),
+        "CACHE_BACKEND": args.cache_backend,
+        "RATE_LIMIT_GROQ_RPS": str(args.provider_rps),
+        "RATE_LIMIT_GROQ_CONCURRENCY": str(args.provider_concurrency),
+        "RATE_LIMIT_TAVILY_RPS": str(args.provider_rps),
+        "RATE_LIMIT_TAVILY_CONCURRENCY": str(args.provider_concurrency),
+        "RATE_LIMIT_HTTP_RPS": str(args.provider_rps),
+    })
+
+
+def run_benchmark(args):
+    servers = FakeProviderServers(
+        schools=args.schools,
+        noise_sites=args.noise_sites,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        page_kb=args.page_kb,
+    ).start()
+    cache_dir = tempfile.mkdtemp(prefix="windsurf_benchmark_")
+    _configure_environment(servers, cache_dir, args)
+
+    # Imported only after the environment points every provider at the fake servers.
+    from cache import all_cache_stats
+    from windsurf_data_aggregator import run_pipeline
+
+    reports = []
+    try:
+        for run in range(args.runs):
+            servers.reset_stats()
+            cache_before = all_cache_stats()
+            started = time.perf_counter()
+            results = asyncio.run(run_pipeline(args.area, run_id=f"benchmark-{run}"))
+            wall_time = time.perf_counter() - started
+            cache_after = all_cache_stats()
+
+            lookups = cache_after["lookups"] - cache_before["lookups"]
+            hits = cache_after["hits"] - cache_before["hits"]
+            requests = sum(len(latencies) for latencies in servers.latencies.values())
+            reports.append({
+                "run": run,
+                "wall_time_s": round(wall_time, 3),
+                "domains_aggregated": len(results or {}),
+                "requests": requests,
+                "requests_per_s": round(requests / wall_time, 2) if wall_time else None,
+                "rate_limited_responses": dict(servers.errors),
+                "latency_ms": {
+                    endpoint: {
+                        "count": len(latencies),
+                        "p50": round(_percentile(latencies, 50) * 1000, 1),
+                        "p95": round(_percentile(latencies, 95) * 1000, 1),
+                    }
+                    for endpoint, latencies in servers.latencies.items() if latencies
+                },
+                "cache_hit_rate": round(hits / lookups, 3) if lookups else None,
+                # ru_maxrss is reported in kilobytes on Linux.
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            })
+    finally:
+        servers.stop()
+    return reports
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the pipeline end to end against local fake providers.")
+    parser.add_argument("--area", default="Lanzarote")
+    parser.add_argument("--schools", type=int, default=20)
+    parser.add_argument("--noise-sites", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--page-kb", type=int, default=80)
+    parser.add_argument("--runs", type=int, default=2, help="The second and later runs measure the warm cache")
+    parser.add_argument("--cache-backend", default="sqlite", choices=["json", "sqlite"])
+    parser.add_argument("--provider-rps", type=float, default=50)
+    parser.add_argument("--provider-concurrency", type=int, default=16)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    reports = run_benchmark(args)
+    print(json.dumps(reports, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=4)
@@ -1,45 +1,420 @@
+import atexit
+import copy
 import json
 import os
+import sqlite3
+import threading
+import time
 import urllib.parse
+import weakref
+import zlib
+from collections import OrderedDict
+from instrumentation import span
 
-class Cache:
-    def __init__(self, cache_dir="cache", tool=None):
+DAY = 24 * 3600
+
+# Default time-to-live per tool in seconds for the SQLite backend. None means the entry never
+# expires. Override with CACHE_TTL_<TOOL> (e.g. CACHE_TTL_TAVILY=3600), which also applies to the
+# JSON backend; without it JSON files never expire, as before.
+TOOL_TTLS = {
+    "tavily": 14 * DAY,
+    "tavily_particular_website": 14 * DAY,
+    "windsurf_finder": 30 * DAY,
+    "windsurf_website_analyzer": 30 * DAY,
+    "windsurf_data_aggregator": 90 * DAY,
+    "groq_structured_query": 90 * DAY,
+    "page_validators": None,
+    "page_content": 14 * DAY,
+}
+
+
+def _env_number(name, cast=int):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return None
+    return cast(value)
+
+
+def _tool_ttl(tool, defaults=True):
+    env_ttl = _env_number(f"CACHE_TTL_{(tool or 'default').upper()}", float)
+    if env_ttl is not None:
+        return env_ttl if env_ttl > 0 else None
+    return TOOL_TTLS.get(tool) if defaults else None
+
+
+class JsonFileCacheBackend:
+    def __init__(self, cache_dir, ttl=None):
         self.cache_dir = cache_dir
-        self.tool = tool
-        if tool:
-            self.cache_dir = os.path.join(self.cache_dir, tool)
+        self.ttl = ttl
         os.makedirs(self.cache_dir, exist_ok=True)
 
     def _get_cache_path(self, key):
         encoded_key = urllib.parse.quote_plus(key)
         return os.path.join(self.cache_dir, f"{encoded_key}.json")
 
-
     def get(self, key):
         cache_path = self._get_cache_path(key)
-        if os.path.exists(cache_path):
+        try:
+            if self.ttl and time.time() - os.path.getmtime(cache_path) > self.ttl:
+                return None
             with open(cache_path, "r") as f:
                 return json.load(f)
-        return None
+        except FileNotFoundError:
+            return None
 
     def set(self, key, value):
         cache_path = self._get_cache_path(key)
         with open(cache_path, "w") as f:
             json.dump(value, f, indent=4)
+
+    def flush(self):
+        pass
+
+
+class SqliteCacheBackend:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            tool TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (tool, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS entries_lru ON entries (tool, accessed_at);
+        CREATE INDEX IF NOT EXISTS entries_created ON entries (tool, created_at);
+    """
+
+    def __init__(self, db_path, tool, ttl=None, max_entries=None, max_bytes=None,
+                 batch_size=64, flush_interval=2.0, sweep_interval=None):
+        self.db_path = db_path
+        self.tool = tool or "default"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # TTL and size sweeps run at most this often (CACHE_SWEEP_INTERVAL seconds), not on every
+        # flush; get() already ignores expired rows, and the size caps may overshoot in between.
+        self.sweep_interval = sweep_interval if sweep_interval is not None else (
+            _env_number("CACHE_SWEEP_INTERVAL", float) or 300.0)
+        self._last_sweep = None
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._touched = {}
+        self._last_flush = time.monotonic()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _encode(value):
+        return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _decode(blob):
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                return self._decode(pending[0])
+            row = self._conn.execute(
+                "SELECT value, created_at FROM entries WHERE tool = ? AND key = ?",
+                (self.tool, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[1], now):
+                self._conn.execute("DELETE FROM entries WHERE tool = ? AND key = ?", (self.tool, key))
+                self._conn.commit()
+                return None
+            self._touched[key] = now
+            self._maybe_flush()
+        return self._decode(row[0])
+
+    def set(self, key, value, created_at=None):
+        blob = self._encode(value)
+        with self._lock:
+            self._pending[key] = (blob, created_at or time.time())
+            self._touched.pop(key, None)
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self._pending) + len(self._touched) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self, sweep=False):
+        with self._lock:
+            if not self._pending and not self._touched and not sweep:
+                self._last_flush = time.monotonic()
+                return
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (tool, key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.tool, key, blob, len(blob), created_at, now)
+                 for key, (blob, created_at) in self._pending.items()],
+            )
+            self._conn.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE tool = ? AND key = ?",
+                [(accessed_at, self.tool, key) for key, accessed_at in self._touched.items()],
+            )
+            self._pending.clear()
+            self._touched.clear()
+            if sweep or self._last_sweep is None or time.monotonic() - self._last_sweep >= self.sweep_interval:
+                self._evict()
+                self._last_sweep = time.monotonic()
+            self._conn.commit()
+            self._last_flush = time.monotonic()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute(
+                "DELETE FROM entries WHERE tool = ? AND created_at < ?",
+                (self.tool, time.time() - self.ttl),
+            )
+        if not self.max_entries and not self.max_bytes:
+            return
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE tool = ?", (self.tool,)
+        ).fetchone()
+        excess_entries = max(0, count - self.max_entries) if self.max_entries else 0
+        excess_bytes = max(0, total - self.max_bytes) if self.max_bytes else 0
+        if not excess_entries and not excess_bytes:
+            return
+        victims = []
+        freed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM entries WHERE tool = ? ORDER BY accessed_at", (self.tool,)
+        ):
+            if len(victims) >= excess_entries and freed >= excess_bytes:
+                break
+            victims.append((self.tool, key))
+            freed += size
+        self._conn.executemany("DELETE FROM entries WHERE tool = ? AND key = ?", victims)
+
+    def import_json_dir(self, json_dir):
+        imported = 0
+        for file_name in os.listdir(json_dir):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(json_dir, file_name)
+            key = urllib.parse.unquote_plus(file_name[:-len(".json")])
+            try:
+                with open(path, "r") as f:
+                    value = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            self.set(key, value, created_at=os.path.getmtime(path))
+            imported += 1
+        self.flush(sweep=True)
+        return imported
+
+
+class MemoryCache:
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[0]
+        # Callers merge cached results into their own structures, so never hand out the stored object.
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        size = len(json.dumps(value, separators=(",", ":")))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+
+_instances = weakref.WeakSet()
+_memory_tiers = {}
+_memory_tiers_lock = threading.Lock()
+
+
+def _shared_memory_tier(name):
+    max_entries = _env_number("CACHE_MEMORY_MAX_ENTRIES")
+    max_bytes = _env_number("CACHE_MEMORY_MAX_BYTES")
+    if max_entries == 0 or max_bytes == 0:
+        return None
+    with _memory_tiers_lock:
+        if name not in _memory_tiers:
+            _memory_tiers[name] = MemoryCache(
+                max_entries=4096 if max_entries is None else max_entries,
+                max_bytes=64 * 1024 * 1024 if max_bytes is None else max_bytes,
+            )
+        return _memory_tiers[name]
+
+
+class Cache:
+    def __init__(self, cache_dir=None, tool=None, backend=None, ttl=None, max_entries=None, max_bytes=None,
+                 memory_tier=True):
+        self.root_dir = cache_dir or os.getenv("CACHE_DIR", "cache")
+        self.cache_dir = self.root_dir
+        self.tool = tool
+        if tool:
+            self.cache_dir = os.path.join(self.cache_dir, tool)
+        self.backend_name = backend or os.getenv("CACHE_BACKEND", "json")
+        if ttl is None:
+            ttl = _tool_ttl(tool, defaults=self.backend_name == "sqlite")
+        if self.backend_name == "sqlite":
+            self.backend = SqliteCacheBackend(
+                os.path.join(self.root_dir, "cache.sqlite3"),
+                tool,
+                ttl=ttl,
+                max_entries=max_entries or _env_number("CACHE_MAX_ENTRIES"),
+                max_bytes=max_bytes or _env_number("CACHE_MAX_BYTES"),
+            )
+        elif self.backend_name == "json":
+            self.backend = JsonFileCacheBackend(self.cache_dir, ttl=ttl)
+        else:
+            raise ValueError(f"Unknown cache backend: {self.backend_name}")
+        # The memory tier is shared by every Cache pointing at the same store, so re-created
+        # finders/analyzers in one process keep the keys their predecessors already read.
+        self.memory = _shared_memory_tier((self.backend_name, os.path.abspath(self.cache_dir))) if memory_tier else None
+        self.lookups = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._stats_lock = threading.Lock()
+        _instances.add(self)
+
+    def get(self, key, legacy_key=None):
+        # legacy_key is the key an entry had before hashed keys (cache_keys), for the schemes that
+        # were not lossy; such an entry is copied to key the first time it is read.
+        if legacy_key is not None:
+            value = self.get(key)
+            if value is None:
+                value = self.backend.get(legacy_key)
+                if value is not None:
+                    self.set(key, value)
+            return value
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                with self._stats_lock:
+                    self.lookups += 1
+                    self.hits += 1
+                return value
+        with span("cache:read", trace=False, tool=self.tool):
+            value = self.backend.get(key)
+        with self._stats_lock:
+            self.lookups += 1
+            if value is None:
+                self.disk_misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+        if value is not None and self.memory is not None:
+            self.memory.set(key, value)
         return value
 
+    def set(self, key, value):
+        with span("cache:write", trace=False, tool=self.tool):
+            self.backend.set(key, value)
+        if self.memory is not None:
+            self.memory.set(key, value)
+        return value
+
+    def stats(self):
+        with self._stats_lock:
+            disk = {"hits": self.disk_hits, "misses": self.disk_misses}
+            total = {"lookups": self.lookups, "hits": self.hits}
+        return {
+            "memory": self.memory.stats() if self.memory is not None else None,
+            "disk": disk,
+            "total": total,
+        }
+
+    def flush(self):
+        self.backend.flush()
+
+
+def all_cache_stats():
+    memory = {"hits": 0, "misses": 0}
+    disk = {"hits": 0, "misses": 0}
+    lookups = 0
+    hits = 0
+    for tier in list(_memory_tiers.values()):
+        tier_stats = tier.stats()
+        memory["hits"] += tier_stats["hits"]
+        memory["misses"] += tier_stats["misses"]
+    for cache in list(_instances):
+        cache_stats = cache.stats()
+        disk["hits"] += cache_stats["disk"]["hits"]
+        disk["misses"] += cache_stats["disk"]["misses"]
+        lookups += cache_stats["total"]["lookups"]
+        hits += cache_stats["total"]["hits"]
+    return {"memory": memory, "disk": disk, "lookups": lookups, "hits": hits, "hit_rate": hits / lookups if lookups else 0.0}
+
+
+def migrate_json_cache(cache_dir="cache"):
+    # Imports every entry as it is. Only finder area results and site searches are still read
+    # under their pre-hash keys (see Cache.get); entries from the other, lossy key schemes
+    # (search queries, classifications, extractions, subpages, website analysis) are dead weight.
+    imported = {}
+    for tool in sorted(os.listdir(cache_dir)):
+        tool_dir = os.path.join(cache_dir, tool)
+        if not os.path.isdir(tool_dir):
+            continue
+        cache = Cache(cache_dir=cache_dir, tool=tool, backend="sqlite")
+        imported[tool] = cache.backend.import_json_dir(tool_dir)
+    return imported
+
 if __name__ == '__main__':
     cache = Cache()
     test_key = "test_key"
     test_value = {"test": "value"}
-    
+
     # Test set
     cache.set(test_key, test_value)
-    
+
     # Test get
     retrieved_value = cache.get(test_key)
     print(f"Retrieved value: {retrieved_value}")
-    
+
     # Test get non-existent key
     non_existent_value = cache.get("non_existent_key")
     print(f"Non-existent value: {non_existent_value}")
+    print(f"Stats: {cache.stats()}")
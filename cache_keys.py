@@ -0,0 +1,36 @@
+import hashlib
+import json
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", text or "")
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def make_cache_key(namespace, input_text, model=None, prompt_version=None, schema=None, **params):
+    # Every field that changes the provider's answer is part of the digest, so two inputs only
+    # share a key when they would produce the same request.
+    payload = {
+        "input": normalize_text(input_text),
+        "model": model,
+        "prompt_version": prompt_version,
+        "schema": schema,
+        "params": params,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    digest = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    return f"{namespace}_{digest}"
+
+
+def content_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+if __name__ == '__main__':
+    print(make_cache_key("search", "windsurf schools or shops in Lanzarote", max_results=10))
+    print(make_cache_key("structured", "Same   page header", model="mixtral-8x7b-32768", prompt_version=1, schema={"pricing": None}))
+    print(make_cache_key("structured", "Same page header", model="mixtral-8x7b-32768", prompt_version=1, schema={"courses": []}))
+    print(content_hash("Prices:  45 EUR\n") == content_hash("Prices: 45 EUR"))
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Pipeline modules are imported inside the commands, so `--help`, dry runs and the import check
+# do not pay for provider SDKs they never use.
+HEAVY_MODULES = ["groq", "tavily", "aiohttp", "bs4", "tqdm", "google.generativeai", "selectolax", "lxml", "tiktoken"]
+PIPELINE_MODULES = ["batch_runner", "windsurf_data_aggregator", "windsurf_website_analyzer", "windsurf_finder", "llm_query"]
+
+
+def _print_json(data):
+    print(json.dumps(data, indent=4, ensure_ascii=False))
+
+
+def _dry_run(args):
+    # Reports what a run would do and how much of it is already cached, without calling a provider.
+    from cache import Cache
+    from cache_keys import make_cache_key
+    from llm_router import get_llm_router
+    finder_cache = Cache(tool="windsurf_finder")
+    areas = {}
+    for area in args.areas:
+        domains = finder_cache.get(make_cache_key("all_results", area), legacy_key=f"all_results_{area}")
+        areas[area] = {"cached_domains": len(domains) if domains else None}
+    _print_json({
+        "command": args.command,
+        "areas": areas,
+        "run_id": getattr(args, "run_id", None),
+        "refresh": getattr(args, "refresh", False),
+        "llm_backends": [backend.name for backend in get_llm_router().backends],
+        "cache_backend": os.getenv("CACHE_BACKEND", "json"),
+    })
+
+
+async def _close(coro):
+    # run and batch export their own metrics; the single-stage commands do it here.
+    import instrumentation
+    from http_session import close_http_session
+    try:
+        return await coro
+    finally:
+        await close_http_session()
+        instrumentation.export()
+
+
+def cmd_find(args):
+    from windsurf_finder import WindsurfFinder
+    finder = WindsurfFinder()
+    _print_json({area: asyncio.run(_close(finder.find_windsurf_locations_async(area))) for area in args.areas})
+
+
+def cmd_analyze(args):
+    from windsurf_website_analyzer import WindsurfWebsiteAnalyzer
+
+    async def _analyze(area):
+        analyzer = WindsurfWebsiteAnalyzer()
+        return await analyzer.analyze_websites_async(await analyzer._get_windsurf_finder_results_async(area))
+
+    _print_json({area: asyncio.run(_close(_analyze(area))) for area in args.areas})
+
+
+def cmd_aggregate(args):
+    from windsurf_data_aggregator import WindsurfDataAggregator
+    from windsurf_website_analyzer import WindsurfWebsiteAnalyzer
+
+    async def _aggregate(area):
+        if args.analysis:
+            with open(args.analysis, encoding="utf-8") as f:
+                website_analysis = json.load(f)
+            # Output of `analyze` is keyed by area; a bare domain -> categories map works too.
+            website_analysis = website_analysis.get(area, website_analysis)
+        else:
+            analyzer = WindsurfWebsiteAnalyzer()
+            website_analysis = await analyzer.analyze_websites_async(await analyzer._get_windsurf_finder_results_async(area))
+        return await WindsurfDataAggregator(refresh=args.refresh).aggregate_data_async(website_analysis)
+
+    _print_json({area: asyncio.run(_close(_aggregate(area))) for area in args.areas})
+
+
+def cmd_run(args):
+    from windsurf_data_aggregator import run_pipeline
+    _print_json({area: asyncio.run(run_pipeline(area, run_id=args.run_id, refresh=args.refresh)) for area in args.areas})
+
+
+def cmd_batch(args):
+    from batch_runner import run_batch, stream_batch
+    if args.jsonl:
+        lines = asyncio.run(stream_batch(args.areas, args.jsonl, run_id=args.run_id, refresh=args.refresh))
+        print(f"Wrote {lines} records to {args.jsonl}")
+    else:
+        _print_json(asyncio.run(run_batch(args.areas, run_id=args.run_id, refresh=args.refresh)))
+
+
+def cmd_check_imports(args):
+    # Imports every pipeline module in a fresh interpreter and fails when that takes longer than
+    # the budget or loads a provider SDK before any request is made.
+    script = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        f"for name in {PIPELINE_MODULES!r}:\n"
+        "    __import__(name)\n"
+        "seconds = time.perf_counter() - started\n"
+        f"heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'heavy_modules': heavy}))\n"
+    )
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    report = json.loads(output)
+    report["budget_seconds"] = args.budget
+    report["ok"] = report["seconds"] <= args.budget and not report["heavy_modules"]
+    _print_json(report)
+    return 0 if report["ok"] else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Find windsurf schools in an area and extract their prices and services.")
+    parser.add_argument("--metrics", action="store_true", help="Record spans and token usage (like PIPELINE_METRICS=1)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def _command(name, func, help, refresh=True, manifest=False):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("areas", nargs="*", default=["Lanzarote"])
+        command.add_argument("--dry-run", action="store_true", help="Show the plan and cache state without calling providers")
+        if manifest:
+            # Only run and batch keep a run manifest to resume from.
+            command.add_argument("--run-id", help="Resume an earlier run by its id (printed when the run starts)")
+        if refresh:
+            command.add_argument("--refresh", action="store_true", help="Revalidate cached subpages against the sites")
+        command.set_defaults(func=func)
+        return command
+
+    _command("find", cmd_find, "Search an area and keep the windsurf domains", refresh=False)
+    _command("analyze", cmd_analyze, "Find domains and categorize their subpages", refresh=False)
+    _command("aggregate", cmd_aggregate, "Extract one record per domain").add_argument(
+        "--analysis", help="JSON output of `analyze` to aggregate instead of analyzing again")
+    _command("run", cmd_run, "The whole pipeline, one area at a time, with a run manifest", manifest=True)
+    _command("batch", cmd_batch, "The whole pipeline for many areas at once", manifest=True).add_argument(
+        "--jsonl", help="Append records to this JSONL file as they finish")
+
+    check = commands.add_parser("check-imports", help="Fail if importing the pipeline is slow or loads provider SDKs")
+    check.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET_SECONDS", "0.5")))
+    check.set_defaults(func=cmd_check_imports)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        import instrumentation
+        instrumentation.enable()
+    if getattr(args, "dry_run", False):
+        started = time.perf_counter()
+        _dry_run(args)
+        print(f"Dry run took {time.perf_counter() - started:.3f}s")
+        return 0
+    return args.func(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
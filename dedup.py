@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import os
+import re
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Query parameters that select a tracking source, language or print layout rather than different
+# content. Language variants of a school's page carry the same prices and contact details.
+IGNORED_QUERY_PARAMS = re.compile(
+    r"^(utm_[a-z]+|fbclid|gclid|msclkid|mc_[a-z]+|ref|sessionid|sid|phpsessid|"
+    r"lang|language|locale|hl|print|amp)$",
+    re.I,
+)
+INDEX_PAGES = re.compile(r"/(index|default|home)\.(html?|php|aspx?)$", re.I)
+PRINT_PATHS = re.compile(r"/(print|amp)/?$", re.I)
+
+
+def canonicalize_url(url):
+    # Maps the spellings of one page (case, default port, trailing slash, index file, tracking,
+    # language and print parameters, fragment) to one URL.
+    parsed = urlparse(url.strip())
+    scheme = (parsed.scheme or "http").lower()
+    host = (parsed.hostname or "").lower()
+    if parsed.port and not ((scheme == "http" and parsed.port == 80) or (scheme == "https" and parsed.port == 443)):
+        host = f"{host}:{parsed.port}"
+    path = INDEX_PAGES.sub("/", parsed.path or "/")
+    path = PRINT_PATHS.sub("/", path)
+    path = re.sub(r"/{2,}", "/", path)
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                   if not IGNORED_QUERY_PARAMS.match(key))
+    return urlunparse((scheme, host, path, "", urlencode(query), ""))
+
+
+# Spreads each byte of a 64-bit hash into 20-bit counter lanes, one lane per bit, so that one big
+# integer addition per shingle updates all 64 bit counters at once.
+_LANE_BITS = 20
+_SPREAD = [
+    [sum(1 << ((position * 8 + bit) * _LANE_BITS) for bit in range(8) if value >> bit & 1) for value in range(256)]
+    for position in range(8)
+]
+
+
+def simhash(text, shingle=3):
+    # 64-bit SimHash over distinct word shingles: near-identical texts differ in only a few bits.
+    # Every shingle is folded in; sampling long pages made fingerprints on either side of the
+    # sampling threshold incomparable, and hashing, not folding, is most of the cost anyway.
+    tokens = _TOKEN.findall(text.lower())
+    if len(tokens) < shingle:
+        tokens = tokens + [""] * (shingle - len(tokens))
+    grams = {" ".join(tokens[index:index + shingle]) for index in range(len(tokens) - shingle + 1)}
+    total = 0
+    for gram in grams:
+        d = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        total += (_SPREAD[0][d[0]] + _SPREAD[1][d[1]] + _SPREAD[2][d[2]] + _SPREAD[3][d[3]] +
+                  _SPREAD[4][d[4]] + _SPREAD[5][d[5]] + _SPREAD[6][d[6]] + _SPREAD[7][d[7]])
+    mask = (1 << _LANE_BITS) - 1
+    return sum(1 << bit for bit in range(64) if (total >> (bit * _LANE_BITS)) & mask > len(grams) / 2)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    # Fingerprints within max_distance bits share at least one of max_distance + 1 bands exactly,
+    # so a lookup only compares against fingerprints in the same bands.
+    def __init__(self, max_distance=None):
+        self.max_distance = max_distance if max_distance is not None else int(os.getenv("DEDUP_MAX_DISTANCE", "3"))
+        self.band_count = self.max_distance + 1
+        self.band_bits = 64 // self.band_count
+        self.bands = [{} for _ in range(self.band_count)]
+
+    def _band_values(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(self.band_count)]
+
+    def find(self, fingerprint):
+        for band, value in zip(self.bands, self._band_values(fingerprint)):
+            for key, other in band.get(value, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, key, fingerprint):
+        for band, value in zip(self.bands, self._band_values(fingerprint)):
+            band.setdefault(value, []).append((key, fingerprint))
+
+
+class ContentClusters:
+    # Groups a domain's fetched pages by near-duplicate text. The first page of a cluster is
+    # extracted; the others wait for its result instead of sending the same text to the LLM.
+    def __init__(self, max_distance=None, max_length_ratio=1.1):
+        self.index = SimHashIndex(max_distance)
+        self.max_length_ratio = max_length_ratio
+        self.lengths = {}
+        self.results = {}
+
+    def join(self, url, text):
+        # Returns (representative url, future of its extraction) if the text is a near-duplicate,
+        # else registers url as a new cluster and returns None.
+        fingerprint = simhash(text)
+        representative = self.index.find(fingerprint)
+        if representative is not None:
+            lengths = sorted((len(text), self.lengths[representative]))
+            if lengths[1] <= lengths[0] * self.max_length_ratio:
+                return representative, self.results[representative]
+        self.index.add(url, fingerprint)
+        self.lengths[url] = len(text)
+        self.results[url] = asyncio.get_running_loop().create_future()
+        return None
+
+    def resolve(self, url, extracted_data):
+        future = self.results.get(url)
+        if future is not None and not future.done():
+            future.set_result(extracted_data)
+
+if __name__ == '__main__':
+    for url in ["https://Example.com:443/prices/?utm_source=x&lang=es#top", "https://example.com/prices",
+                "https://example.com/index.html", "https://example.com/prices/print"]:
+        print(url, "->", canonicalize_url(url))
+    text = " ".join(f"Windsurf lesson {hours} hours costs {hours * 45} EUR including wetsuit and board." for hours in range(1, 40))
+    print(hamming_distance(simhash(text), simhash(text + " Updated May.")), hamming_distance(simhash(text), simhash("Contact us in Costa Teguise")))
@@ -0,0 +1,99 @@
+import copy
+import json
+
+# Schema sections each analyzer category can fill. Categories not listed here (weather_conditions,
+# anything new) get the whole schema, as every page did before.
+CATEGORY_SECTIONS = {
+    "location_information": ("location_information",),
+    "pricing": ("pricing",),
+    "courses": ("courses",),
+    "camps": ("courses", "pricing"),
+    "transport_options": ("transport_options",),
+}
+
+
+def sections_for(categories, schema):
+    # The schema sections a page listed under these categories should be asked for, in schema order.
+    wanted = set()
+    for category in categories:
+        wanted.update(CATEGORY_SECTIONS.get(category, schema))
+    return tuple(section for section in schema if section in wanted)
+
+
+def subschema(schema, sections):
+    return {section: copy.deepcopy(schema[section]) for section in sections if section in schema}
+
+
+_RESOLVED = object()
+
+
+def _is_known(value):
+    return value not in (None, "", [], {})
+
+
+def _unresolved(schema, known):
+    # The part of schema whose leaves are still empty in known. Lists (courses) accumulate across
+    # pages, so they are always asked for.
+    if isinstance(schema, dict):
+        known = known if isinstance(known, dict) else {}
+        pruned = {}
+        for key, value in schema.items():
+            remaining = _unresolved(value, known.get(key))
+            if remaining is not _RESOLVED:
+                pruned[key] = remaining
+        return pruned or _RESOLVED
+    if isinstance(schema, list):
+        return copy.deepcopy(schema)
+    return _RESOLVED if _is_known(known) else schema
+
+
+def _count_leaves(schema):
+    if isinstance(schema, dict):
+        return sum(_count_leaves(value) for value in schema.values())
+    return 1
+
+
+class MissingFields:
+    # Tracks which schema fields a domain's merged subpages have already filled in, so pages
+    # extracted later are only asked for what is still unresolved.
+    def __init__(self, schema):
+        self.schema = schema
+        self.known = {}
+        self.pruned_fields = 0
+
+    def update(self, data):
+        def _fill(known, new):
+            for key, value in new.items():
+                if isinstance(value, dict):
+                    _fill(known.setdefault(key, {}), value)
+                elif _is_known(value) and not _is_known(known.get(key)):
+                    known[key] = value
+
+        if isinstance(data, dict):
+            _fill(self.known, data)
+
+    def is_resolved(self, sections):
+        return _unresolved(subschema(self.schema, sections), self.known) is _RESOLVED
+
+    def schema_for(self, sections):
+        # The pruned schema for these sections, or None when every field in them is already known.
+        scoped = subschema(self.schema, sections)
+        remaining = _unresolved(scoped, self.known)
+        if remaining is _RESOLVED:
+            self.pruned_fields += _count_leaves(scoped)
+            return None
+        self.pruned_fields += _count_leaves(scoped) - _count_leaves(remaining)
+        return remaining
+
+if __name__ == '__main__':
+    schema = {
+        "location_information": {"name": None, "city": None},
+        "pricing": {"windsurfing": {"hourly_rate": None, "daily_rate": None}},
+        "courses": [],
+    }
+    sections = sections_for(["pricing", "camps"], schema)
+    print(sections)
+    missing = MissingFields(schema)
+    missing.update({"pricing": {"windsurfing": {"hourly_rate": "25 EUR"}}})
+    print(json.dumps(missing.schema_for(sections)))
+    print(missing.schema_for(("location_information",)), missing.pruned_fields)
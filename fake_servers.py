@@ -0,0 +1,305 @@
+import ast
+import asyncio
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from aiohttp import web
+
+CATEGORY_KEYWORDS = {
+    "windsurf_rental_or_school": ["windsurf school", "windsurf center", "windsurf rental"],
+    "windsurfing_magazine": ["magazine", "news"],
+    "sport_complex": ["sport complex", "sports resort"],
+    "holiday_center": ["holiday center", "holiday village"],
+    "location_information": ["contact", "location", "address", "find us"],
+    "pricing": ["price", "prices", "rates"],
+    "camps": ["camp"],
+    "courses": ["course", "lesson"],
+    "weather_conditions": ["weather", "wind"],
+    "transport_options": ["transfer", "airport", "pickup"],
+}
+
+SUBPAGES = [
+    ("", "Home"),
+    ("prices", "Prices and rates"),
+    ("courses", "Windsurf courses and lessons"),
+    ("contact", "Contact and location"),
+    ("camps", "Windsurf camps"),
+    ("transfers", "Airport transfers and pickup"),
+    ("weather", "Wind and weather"),
+    ("blog/season-report", "Season report news"),
+    ("about-us", "About the team"),
+]
+
+FILLER = (
+    "Lanzarote offers steady trade winds from April to September and flat water in the bay. "
+    "Our instructors speak English, Spanish and German and the beach is a short walk from the center. "
+)
+
+
+class FakeProviderServers:
+    # Local stand-ins for the Groq chat API, the Tavily search API and the schools' websites. Each
+    # site listens on its own port so every fake school is a separate domain for the pipeline.
+    def __init__(self, schools=20, noise_sites=10, latency_ms=150, jitter_ms=50, error_rate=0.0,
+                 page_kb=80, seed=0):
+        self.schools = schools
+        self.noise_sites = noise_sites
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.page_kb = page_kb
+        self.random = random.Random(seed)
+        self.api_url = None
+        self.site_urls = []
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._pages = {}
+        self._loop = None
+        self._thread = None
+        self._runners = []
+
+    def reset_stats(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def start(self):
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def _run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name="fake-provider-servers", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        future = asyncio.run_coroutine_threadsafe(self._stop(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _serve(self, app):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock).start()
+        self._runners.append(runner)
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    async def _start(self):
+        api = web.Application(client_max_size=16 * 1024 * 1024)
+        api.router.add_post("/openai/v1/chat/completions", self._chat_completions)
+        api.router.add_post("/search", self._search)
+        self.api_url = await self._serve(api)
+        for _ in range(self.schools + self.noise_sites):
+            site = web.Application()
+            site.router.add_get("/{path:.*}", self._page)
+            self.site_urls.append(await self._serve(site))
+
+    async def _stop(self):
+        for runner in self._runners:
+            await runner.cleanup()
+
+    async def _simulate(self, endpoint):
+        started = time.perf_counter()
+        delay = max(0.0, self.random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        if self.random.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            return started, web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                status=429,
+                headers={"retry-after": "1"},
+            )
+        return started, None
+
+    def _record(self, endpoint, started):
+        self.latencies[endpoint].append(time.perf_counter() - started)
+
+    def _is_school(self, site_index):
+        return site_index < self.schools
+
+    # Groq / OpenAI-compatible chat completions
+
+    async def _chat_completions(self, request):
+        started, error = await self._simulate("groq")
+        if error is not None:
+            return error
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        content = json.dumps(self._completion_for(prompt))
+        self._record("groq", started)
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4,
+            },
+        })
+
+    @staticmethod
+    def _json_after(prompt, marker):
+        start = prompt.index(marker) + len(marker)
+        return json.JSONDecoder().raw_decode(prompt[start:].lstrip())[0]
+
+    def _completion_for(self, prompt):
+        if "following format:" in prompt:
+            schema = self._json_after(prompt, "following format:")
+            text = prompt.split("Text:", 1)[1]
+            return self._fill_schema(schema, text)
+        categories = ast.literal_eval(re.search(r"categories: (\[.*?\])", prompt).group(1))
+        if "Items:" in prompt:
+            items = self._json_after(prompt, "Items:")
+            return {item_id: self._probabilities(text, categories) for item_id, text in items.items()}
+        return self._probabilities(prompt.split("Input text:", 1)[1], categories)
+
+    def _probabilities(self, text, categories):
+        text = text.lower()
+        return {
+            category: 0.9 if any(keyword in text for keyword in CATEGORY_KEYWORDS.get(category, [category])) else 0.05
+            for category in categories
+        }
+
+    def _fill_schema(self, schema, text):
+        prices = re.findall(r"\d+ EUR", text)
+        email = re.search(r"[\w.]+@[\w.]+", text)
+        school = re.search(r"(Windsurf Center \d+)", text)
+
+        def _fill(node, key=None):
+            if isinstance(node, dict):
+                return {k: _fill(v, k) for k, v in node.items()}
+            if isinstance(node, list):
+                return [{"name": "Beginner course", "price": prices[0]}] if prices and key == "courses" else []
+            if key in ("hourly_rate", "daily_rate", "package_3_to_7_days", "rental_rate_per_hour", "rental_rate_per_day", "cost", "cost_per_day"):
+                return prices.pop(0) if prices else None
+            if key == "name":
+                return school.group(1) if school else None
+            if key == "city":
+                return "Costa Teguise" if "Costa Teguise" in text else None
+            if key == "email":
+                return email.group(0) if email else None
+            if key in ("availability", "included", "included_in_pricing", "from_airport", "from_city_center"):
+                return True if key in text or "available" in text else None
+            return None
+
+        return _fill(schema)
+
+    # Tavily-compatible search
+
+    async def _search(self, request):
+        started, error = await self._simulate("tavily")
+        if error is not None:
+            return error
+        body = await request.json()
+        include_domains = body.get("include_domains") or []
+        if include_domains:
+            site_index = [url.split("//", 1)[1] for url in self.site_urls].index(include_domains[0])
+            results = self._site_results(site_index, raw_content=body.get("include_raw_content"))
+        else:
+            results = [self._site_results(index)[0] for index in range(len(self.site_urls))]
+        results = results[:body.get("max_results", 10)]
+        self._record("tavily", started)
+        return web.json_response({
+            "query": body.get("query"),
+            "follow_up_questions": None,
+            "answer": None,
+            "images": [],
+            "results": results,
+            "response_time": round(time.perf_counter() - started, 3),
+        })
+
+    def _site_results(self, site_index, raw_content=False):
+        base_url = self.site_urls[site_index]
+
+        def _raw(path):
+            if not raw_content:
+                return None
+            html = self._render_page(site_index, path)
+            return re.sub(r"\s+", " ", re.sub(r"<script.*?</script>|<[^>]+>", " ", html)).strip()
+
+        if not self._is_school(site_index):
+            return [{
+                "title": f"Lanzarote travel magazine {site_index}",
+                "url": f"{base_url}/",
+                "content": "Holiday news, hotel deals and things to do in Lanzarote.",
+                "score": 0.5,
+                "raw_content": _raw(""),
+            }]
+        return [{
+            "title": f"Windsurf Center {site_index} - {title}",
+            "url": f"{base_url}/{path}",
+            "content": f"Windsurf school and windsurf rental in Costa Teguise. {title}.",
+            "score": 0.9,
+            "raw_content": _raw(path),
+        } for path, title in SUBPAGES]
+
+    # School websites
+
+    async def _page(self, request):
+        started, error = await self._simulate("site")
+        if error is not None:
+            return error
+        site_index = self.site_urls.index(f"http://{request.host}")
+        path = request.match_info["path"]
+        key = (site_index, path)
+        if key not in self._pages:
+            self._pages[key] = self._render_page(site_index, path)
+        etag = '"' + hashlib.md5(self._pages[key].encode("utf-8")).hexdigest() + '"'
+        self._record("site", started)
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=self._pages[key], content_type="text/html", headers={"ETag": etag})
+
+    def _render_page(self, site_index, path):
+        name = f"Windsurf Center {site_index}"
+        hourly = 30 + site_index % 20
+        body = {
+            "prices": f"<h2>Prices</h2><p>Windsurf lesson 1 hour: {hourly} EUR. Daily rental: {hourly * 2} EUR. "
+                      f"5 day package: {hourly * 8} EUR. Equipment insurance: 10 EUR per day.</p>",
+            "courses": f"<h2>Courses</h2><p>Beginner course 3 days: {hourly * 4} EUR. Advanced coaching available.</p>",
+            "contact": f"<h2>Contact</h2><p>{name}, Avenida de las Islas Canarias, Costa Teguise. "
+                       f"Email: info@center{site_index}.example Phone: +34 928 {site_index:03d} 456</p>",
+            "transfers": f"<h2>Transfers</h2><p>Airport pickup available for 25 EUR per person.</p>",
+        }.get(path, f"<h2>{name}</h2><p>Welcome to {name} in Costa Teguise.</p>")
+        # Filler is shuffled per page so that different pages of a site are not near-duplicates.
+        words = FILLER.split()
+        page_random = random.Random(f"{site_index}/{path}")
+        filler = "".join(
+            "<p>" + " ".join(page_random.sample(words, len(words))) + "</p>"
+            for _ in range(max(1, self.page_kb * 1024 // 2 // len(FILLER)))
+        )
+        script = "<script>var tracking = '" + "x" * (self.page_kb * 1024 // 2) + "';</script>"
+        return (
+            f"<html><head><title>{name}</title>{script}</head><body>"
+            f"<nav><a href='/'>Home</a> <a href='/prices'>Prices</a> <a href='/contact'>Contact</a></nav>"
+            f"<div class='cookie-banner'>We use cookies to improve your experience.</div>"
+            f"<main>{body}{filler}</main>"
+            f"<footer>{name} - info@center{site_index}.example</footer></body></html>"
+        )
+
+if __name__ == '__main__':
+    servers = FakeProviderServers(schools=3, noise_sites=1, latency_ms=10).start()
+    print(f"API: {servers.api_url}")
+    for url in servers.site_urls:
+        print(f"Site: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servers.stop()
@@ -1,44 +1,197 @@
 import os
-from groq import Groq
 from dotenv import load_dotenv
+from llm_router import get_llm_router
+from single_flight import get_single_flight
+from cache_keys import make_cache_key
+from record_replay import replay_items
+import asyncio
 import json
 
 load_dotenv()
 
 class GroqQuery:
+    PROMPT_VERSION = 1
+
     def __init__(self):
-        self.api_key = os.getenv("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("GROQ_API_KEY not found in environment variables")
-        self.client = Groq(api_key=self.api_key)
+        # Backends, clients and provider limiters live in the shared router (LLM_BACKENDS).
+        self.router = get_llm_router()
+        self.single_flight = get_single_flight("groq_query")
         self.model = "mixtral-8x7b-32768"
+        self.max_batch_tokens = int(os.getenv("GROQ_BATCH_MAX_TOKENS", "4000"))
+        self.max_replay_items = int(os.getenv("GROQ_BATCH_MAX_ITEMS", "25"))
 
-    def query(self, input_text, categories):
+    def _build_prompt(self, input_text, categories):
         prompt = f"""You are an expert in categorizing text.
         Given the input text, determine the probability of it containing information on of the following categories: {categories}.
         Return a JSON object with the category names as keys and the probabilities as values.
         
         Input text: {input_text}
         """
+        return prompt
+
+    def _build_batch_prompt(self, items, categories):
+        prompt = f"""You are an expert in categorizing text.
+        For each item below, determine the probability of it containing information on each of the following categories: {categories}.
+        Return a JSON object with the item ids as keys. Each value must be a JSON object with the category names as keys and the probabilities as values.
+        
+        Items: {json.dumps(items, ensure_ascii=False)}
+        """
+        return prompt
+
+    def _flight_key(self, input_text, categories):
+        return make_cache_key("classification", input_text, model=self.model, prompt_version=self.PROMPT_VERSION, categories=categories)
+
+    @staticmethod
+    def _estimate_tokens(text):
+        return len(text) // 4 + 1
+
+    def query(self, input_text, categories):
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    }
-                ],
-                model=self.model,
-                response_format={"type": "json_object"}
-            )
-            return chat_completion.choices[0].message.content
+            return self.single_flight.do_sync(self._flight_key(input_text, categories), self._complete, input_text, categories)
+        except Exception as e:
+            print(f"Error during Groq query: {e}")
+            return None
+
+    def _complete(self, input_text, categories):
+        with replay_items({None: self._flight_key(input_text, categories)}):
+            return self.router.complete(self._build_prompt(input_text, categories))
+
+    async def query_async(self, input_text, categories):
+        try:
+            return await self.single_flight.do(self._flight_key(input_text, categories), self._complete_async, input_text, categories)
         except Exception as e:
             print(f"Error during Groq query: {e}")
             return None
 
+    async def _complete_async(self, input_text, categories):
+        with replay_items({None: self._flight_key(input_text, categories)}):
+            return await self.router.complete_async(self._build_prompt(input_text, categories))
+
+    def query_batch(self, items, categories):
+        return asyncio.run(self.query_batch_async(items, categories))
+
+    async def query_batch_async(self, items, categories, progress=None):
+        # items maps an id to its input text; the result maps each id to its category probabilities,
+        # or None when the item could not be classified.
+        return {item_id: result async for item_id, result in self.iter_batch_async(items, categories, progress)}
+
+    async def iter_batch_async(self, items, categories, progress=None):
+        # Like query_batch_async, but yields (id, probabilities) pairs as each batch finishes.
+        # Texts already being classified by another caller are waited for instead of sent again.
+        leading = {}
+        following = {}
+        for item_id, text in items.items():
+            key = self._flight_key(text, categories)
+            future, leader = self.single_flight.claim(key)
+            if leader:
+                leading[item_id] = key
+            else:
+                following[item_id] = future
+
+        tasks = [
+            asyncio.ensure_future(self._classify_batch(batch, categories))
+            for batch in self._make_batches({item_id: items[item_id] for item_id in leading})
+        ]
+        try:
+            for next_batch in asyncio.as_completed(tasks):
+                batch_results = await next_batch
+                for item_id, result in batch_results.items():
+                    self.single_flight.settle(leading.pop(item_id), result)
+                if progress:
+                    progress(len(batch_results))
+                for item_id, result in batch_results.items():
+                    yield item_id, result
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Keys of unfinished batches are released so their followers do not wait forever.
+            for key in leading.values():
+                self.single_flight.settle(key, None)
+        for item_id, future in following.items():
+            result = await asyncio.shield(future)
+            if progress:
+                progress(1)
+            yield item_id, result
+
+    def _make_batches(self, items):
+        batches = []
+        batch = {}
+        batch_tokens = 0
+        for item_id, text in items.items():
+            tokens = self._estimate_tokens(text) + 8
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_replay_items):
+                batches.append(batch)
+                batch = {}
+                batch_tokens = 0
+            batch[item_id] = text
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _classify_batch(self, batch, categories):
+        if len(batch) == 1:
+            (item_id, text), = batch.items()
+            # Not query_async: the batch already holds this text's single-flight slot.
+            try:
+                return {item_id: json.loads(await self._complete_async(text, categories))}
+            except Exception as e:
+                print(f"Error during Groq query: {e}")
+                return {item_id: None}
+
+        # Short positional ids keep the prompt small and are easy for the model to echo back.
+        item_ids = {str(index): item_id for index, item_id in enumerate(batch, 1)}
+        try:
+            with replay_items({index: self._flight_key(batch[item_id], categories) for index, item_id in item_ids.items()}):
+                content = await self.router.complete_async(
+                    self._build_batch_prompt({index: batch[item_id] for index, item_id in item_ids.items()}, categories)
+                )
+        except Exception as e:
+            # The router already retried and failed over; splitting would only multiply the calls
+            # into a provider that is down.
+            print(f"Error during Groq batch query of {len(batch)} items: {e}")
+            return {item_id: None for item_id in batch}
+        # Only an answer the model got wrong (bad JSON, missing items) is worth retrying in
+        # smaller batches.
+        try:
+            parsed = json.loads(content)
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"Could not parse Groq batch answer for {len(batch)} items: {e}")
+            parsed = {}
+
+        results = {}
+        missing = {}
+        for index, item_id in item_ids.items():
+            probabilities = parsed.get(index) if isinstance(parsed, dict) else None
+            if isinstance(probabilities, dict):
+                results[item_id] = probabilities
+            else:
+                missing[item_id] = batch[item_id]
+
+        if len(missing) == len(batch):
+            missing_items = list(missing.items())
+            half = len(missing_items) // 2
+            halves = await asyncio.gather(
+                self._classify_batch(dict(missing_items[:half]), categories),
+                self._classify_batch(dict(missing_items[half:]), categories),
+            )
+            for half_results in halves:
+                results.update(half_results)
+        elif missing:
+            results.update(await self._classify_batch(missing, categories))
+        return results
+
 if __name__ == '__main__':
     groq_query = GroqQuery()
     input_text = "This is a test text about windsurfing schools."
     categories = ["windsurf school", "windsurf shop", "article", "other"]
     result = groq_query.query(input_text, categories)
     print(result)
+    result = asyncio.run(groq_query.query_async(input_text, categories))
+    print(result)
+    items = {
+        "school": input_text,
+        "shop": "Buy windsurf boards, sails and wetsuits online.",
+        "article": "Ten tips for your first windsurfing holiday.",
+    }
+    print(groq_query.query_batch(items, categories))
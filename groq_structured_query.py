@@ -1,52 +1,92 @@
-import os
-from groq import Groq
 from dotenv import load_dotenv
 import json
 from cache import Cache
-import re
+from cache_keys import make_cache_key
+from llm_router import get_llm_router
+from single_flight import get_single_flight
+from record_replay import replay_items
 
 load_dotenv()
 
+
+def _project(schema, data):
+    # A recorded answer to another (pruned) schema, reshaped to this one. Fields it was not asked
+    # for had been filled by pages merged before it, so leaving them empty does not change a record.
+    if isinstance(schema, dict):
+        data = data if isinstance(data, dict) else {}
+        return {key: _project(value, data.get(key)) for key, value in schema.items()}
+    if isinstance(schema, list):
+        return data if isinstance(data, list) else []
+    return data
+
 class GroqStructuredQuery:
+    PROMPT_VERSION = 1
+
     def __init__(self):
-        self.api_key = os.getenv("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("GROQ_API_KEY not found in environment variables")
-        self.client = Groq(api_key=self.api_key)
+        self.router = get_llm_router()
+        self.single_flight = get_single_flight("groq_structured_query")
         self.model = "mixtral-8x7b-32768"
         self.cache = Cache(tool="groq_structured_query")
 
+    def _cache_key(self, input_text, structured_output_format):
+        return make_cache_key(
+            "structured",
+            input_text,
+            model=self.model,
+            prompt_version=self.PROMPT_VERSION,
+            schema=structured_output_format,
+        )
+
+    def _replay_items(self, input_text, structured_output_format):
+        item_key = make_cache_key("structured_item", input_text, model=self.model, prompt_version=self.PROMPT_VERSION)
+        return replay_items({None: item_key}, project=lambda answer: _project(structured_output_format, answer))
+
+    def _build_prompt(self, input_text, structured_output_format):
+        prompt = f"""You are an expert in extracting information from text.
+        Given the input text, extract the information and return a JSON object using the following format:
+        {json.dumps(structured_output_format)}
+        Text: {input_text}
+        """
+        return prompt
+
     def query(self, input_text, structured_output_format):
-        cache_key_text = ''.join(filter(str.isalnum, input_text[:50])).lower()
-        cache_key = f"{cache_key_text}"
+        cache_key = self._cache_key(input_text, structured_output_format)
         cached_result = self.cache.get(cache_key)
         if cached_result:
             print("  - Returning cached result")
             return cached_result
         
-        prompt = f"""You are an expert in extracting information from text.
-        Given the input text, extract the information and return a JSON object using the following format:
-        {json.dumps(structured_output_format)}
-        Text: {input_text}
-        """
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    }
-                ],
-                model=self.model,
-                response_format={"type": "json_object"}
-            )
-            result = json.loads(chat_completion.choices[0].message.content)
-            self.cache.set(cache_key, result)
-            return result
+            return self.single_flight.do_sync(cache_key, self._extract_and_cache, cache_key, input_text, structured_output_format)
+        except Exception as e:
+            print(f"Error during Groq query: {e}")
+            return None
+
+    def _extract_and_cache(self, cache_key, input_text, structured_output_format):
+        with self._replay_items(input_text, structured_output_format):
+            result = json.loads(self.router.complete(self._build_prompt(input_text, structured_output_format)))
+        self.cache.set(cache_key, result)
+        return result
+
+    async def query_async(self, input_text, structured_output_format):
+        cache_key = self._cache_key(input_text, structured_output_format)
+        cached_result = self.cache.get(cache_key)
+        if cached_result:
+            print("  - Returning cached result")
+            return cached_result
+
+        try:
+            return await self.single_flight.do(cache_key, self._extract_and_cache_async, cache_key, input_text, structured_output_format)
         except Exception as e:
             print(f"Error during Groq query: {e}")
             return None
 
+    async def _extract_and_cache_async(self, cache_key, input_text, structured_output_format):
+        with self._replay_items(input_text, structured_output_format):
+            result = json.loads(await self.router.complete_async(self._build_prompt(input_text, structured_output_format)))
+        self.cache.set(cache_key, result)
+        return result
+
 if __name__ == '__main__':
     groq_query = GroqStructuredQuery()
     input_text = "This is a test text about a windsurfing school. They offer hourly rentals for 20 euros and daily rentals for 50 euros."
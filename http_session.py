@@ -0,0 +1,31 @@
+import os
+from async_utils import LoopLocal
+
+
+def _create_session():
+    import aiohttp
+    connector = aiohttp.TCPConnector(
+        limit=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        limit_per_host=int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "8")),
+        keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30")),
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=float(os.getenv("HTTP_TIMEOUT", "30")))
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+_sessions = LoopLocal(_create_session)
+
+
+def get_http_session():
+    session = _sessions.get()
+    if session.closed:
+        _sessions.pop()
+        session = _sessions.get()
+    return session
+
+
+async def close_http_session():
+    session = _sessions.pop()
+    if session is not None and not session.closed:
+        await session.close()
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+# Upper bounds in seconds, Prometheus style; the implicit last bucket is +Inf.
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# USD per million (prompt, completion) tokens, used for cost estimates.
+MODEL_PRICES = {
+    "mixtral-8x7b-32768": (0.24, 0.24),
+    "gemini-pro": (0.5, 1.5),
+}
+
+_enabled = os.getenv("PIPELINE_METRICS", "0") not in ("", "0")
+_NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_seconds": round(self.sum, 6),
+            "errors": self.errors,
+            "buckets": {str(bound): count for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], self.buckets)},
+        }
+
+
+class Recorder:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.histograms = defaultdict(Histogram)
+        self.tokens = defaultdict(lambda: {"prompt": 0, "completion": 0, "requests": 0})
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def _lane(self):
+        # One timeline row per asyncio task (or thread), so concurrent spans do not overlap in the viewer.
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else threading.get_ident()
+        if key not in self._lanes:
+            self._lanes[key] = len(self._lanes) + 1
+        return self._lanes[key]
+
+    def finish(self, span, ended, error):
+        duration = ended - span.started
+        with self._lock:
+            self.histograms[span.name].observe(duration, error)
+            if span.trace:
+                args = dict(span.attrs)
+                if error:
+                    args["error"] = error.__name__
+                self.events.append({
+                    "name": span.name,
+                    "cat": span.name.split(":", 1)[0],
+                    "ph": "X",
+                    "ts": round((span.started - self.origin) * 1e6, 1),
+                    "dur": round(duration * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": self._lane(),
+                    "args": args,
+                })
+
+    def add_usage(self, model, prompt_tokens, completion_tokens):
+        with self._lock:
+            usage = self.tokens[model]
+            usage["prompt"] += prompt_tokens or 0
+            usage["completion"] += completion_tokens or 0
+            usage["requests"] += 1
+
+
+class Span:
+    __slots__ = ("name", "attrs", "trace", "started")
+
+    def __init__(self, name, attrs, trace):
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _recorder.finish(self, time.perf_counter(), exc_type)
+        return False
+
+
+_recorder = Recorder()
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def reset():
+    global _recorder
+    _recorder = Recorder()
+
+
+def span(name, trace=True, **attrs):
+    # Times the block into the histogram for `name`; with trace=True it also becomes a trace event.
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, attrs, trace)
+
+
+def record_usage(model, usage):
+    if not _enabled or usage is None:
+        return
+    _recorder.add_usage(model, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
+
+
+def _cost(model, usage):
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return None
+    return (usage["prompt"] * prices[0] + usage["completion"] * prices[1]) / 1_000_000
+
+
+def _cache_counters():
+    from cache import _instances
+    counters = defaultdict(lambda: {"lookups": 0, "hits": 0, "disk_hits": 0, "disk_misses": 0})
+    for cache in list(_instances):
+        stats = cache.stats()
+        tool = counters[cache.tool or "default"]
+        tool["lookups"] += stats["total"]["lookups"]
+        tool["hits"] += stats["total"]["hits"]
+        tool["disk_hits"] += stats["disk"]["hits"]
+        tool["disk_misses"] += stats["disk"]["misses"]
+    return dict(counters)
+
+
+def _single_flight_counters():
+    from single_flight import single_flight_stats
+    return single_flight_stats()
+
+
+def _llm_router_counters():
+    from llm_router import router_stats
+    return router_stats()
+
+
+def snapshot():
+    with _recorder._lock:
+        histograms = {name: histogram.to_dict() for name, histogram in _recorder.histograms.items()}
+        tokens = {model: dict(usage) for model, usage in _recorder.tokens.items()}
+    for model, usage in tokens.items():
+        usage["cost_usd"] = _cost(model, usage)
+    return {"spans": histograms, "tokens": tokens, "cache": _cache_counters(), "single_flight": _single_flight_counters(),
+            "llm_router": _llm_router_counters()}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(metrics):
+    lines = ["# TYPE pipeline_span_seconds histogram"]
+    for name, histogram in sorted(metrics["spans"].items()):
+        cumulative = 0
+        for bound, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f'pipeline_span_seconds_bucket{{span="{_label(name)}",le="{bound}"}} {cumulative}')
+        lines.append(f'pipeline_span_seconds_sum{{span="{_label(name)}"}} {histogram["sum_seconds"]}')
+        lines.append(f'pipeline_span_seconds_count{{span="{_label(name)}"}} {histogram["count"]}')
+    lines.append("# TYPE pipeline_span_errors_total counter")
+    for name, histogram in sorted(metrics["spans"].items()):
+        lines.append(f'pipeline_span_errors_total{{span="{_label(name)}"}} {histogram["errors"]}')
+    lines.append("# TYPE pipeline_tokens_total counter")
+    for model, usage in sorted(metrics["tokens"].items()):
+        for kind in ("prompt", "completion"):
+            lines.append(f'pipeline_tokens_total{{model="{_label(model)}",kind="{kind}"}} {usage[kind]}')
+    lines.append("# TYPE pipeline_cost_usd_total counter")
+    for model, usage in sorted(metrics["tokens"].items()):
+        if usage["cost_usd"] is not None:
+            lines.append(f'pipeline_cost_usd_total{{model="{_label(model)}"}} {usage["cost_usd"]:.6f}')
+    lines.append("# TYPE pipeline_cache_lookups_total counter")
+    for tool, counters in sorted(metrics["cache"].items()):
+        lines.append(f'pipeline_cache_lookups_total{{tool="{_label(tool)}",result="hit"}} {counters["hits"]}')
+        lines.append(f'pipeline_cache_lookups_total{{tool="{_label(tool)}",result="miss"}} {counters["lookups"] - counters["hits"]}')
+    lines.append("# TYPE pipeline_single_flight_total counter")
+    for name, counters in sorted(metrics["single_flight"].items()):
+        lines.append(f'pipeline_single_flight_total{{flight="{_label(name)}",result="call"}} {counters["calls"]}')
+        lines.append(f'pipeline_single_flight_total{{flight="{_label(name)}",result="coalesced"}} {counters["coalesced"]}')
+    router = metrics.get("llm_router") or {}
+    if router:
+        lines.append("# TYPE pipeline_llm_hedges_total counter")
+        lines.append(f'pipeline_llm_hedges_total{{result="sent"}} {router["hedges"]}')
+        lines.append(f'pipeline_llm_hedges_total{{result="won"}} {router["hedge_wins"]}')
+        lines.append("# TYPE pipeline_llm_failovers_total counter")
+        lines.append(f'pipeline_llm_failovers_total {router["failovers"]}')
+        lines.append("# TYPE pipeline_llm_backend_calls_total counter")
+        for name, backend in sorted(router["backends"].items()):
+            lines.append(f'pipeline_llm_backend_calls_total{{backend="{_label(name)}",result="ok"}} {backend["calls"] - backend["errors"]}')
+            lines.append(f'pipeline_llm_backend_calls_total{{backend="{_label(name)}",result="error"}} {backend["errors"]}')
+        lines.append("# TYPE pipeline_llm_backend_open gauge")
+        for name, backend in sorted(router["backends"].items()):
+            lines.append(f'pipeline_llm_backend_open{{backend="{_label(name)}"}} {int(backend["breaker"] == "open")}')
+    return "\n".join(lines) + "\n"
+
+
+def export(metrics_path=None, trace_path=None):
+    # Writes metrics as JSON (or Prometheus text for a .prom/.txt path) and a Chrome trace
+    # (chrome://tracing, Perfetto or speedscope).
+    if not _enabled:
+        return
+    metrics_path = metrics_path or os.getenv("PIPELINE_METRICS_PATH", "metrics.json")
+    trace_path = trace_path or os.getenv("PIPELINE_TRACE_PATH", "trace.json")
+    metrics = snapshot()
+    with open(metrics_path, "w") as f:
+        if metrics_path.endswith((".prom", ".txt")):
+            f.write(to_prometheus(metrics))
+        else:
+            json.dump(metrics, f, indent=4)
+    with _recorder._lock:
+        events = list(_recorder.events)
+    with open(trace_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print(f"Metrics written to {metrics_path}, trace written to {trace_path}")
+
+if __name__ == '__main__':
+    enable()
+    with span("stage:demo"):
+        for i in range(3):
+            with span("provider:demo", attempt=i):
+                time.sleep(0.01)
+    print(to_prometheus(snapshot()))
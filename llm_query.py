@@ -1,16 +1,11 @@
-import os
-import google.generativeai as genai
 from dotenv import load_dotenv
+from llm_router import GeminiBackend
 
 load_dotenv()
 
 class LLMQuery:
     def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.backend = GeminiBackend()
 
     def query(self, input_text, categories):
         prompt = f"""
@@ -21,9 +16,8 @@ class LLMQuery:
         Input text: {input_text}
         """
         
-        response = self.model.generate_content(prompt)
         try:
-            return response.text
+            return self.backend.complete(prompt)
         except Exception as e:
             print(f"Error during LLM query: {e}")
             return None
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from async_utils import LoopLocal
+from rate_limiter import get_limiter
+from instrumentation import record_usage
+
+load_dotenv()
+
+_JSON_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+class GroqBackend:
+    name = "groq"
+
+    def __init__(self, model="mixtral-8x7b-32768"):
+        self.api_key = os.getenv("GROQ_API_KEY")
+        if not self.api_key:
+            raise ValueError("GROQ_API_KEY not found in environment variables")
+        self._client = None
+        self.async_clients = LoopLocal(self._create_async_client)
+        self.limiter = get_limiter("groq")
+        self.model = model
+
+    # Clients (and the groq package) are only loaded once a request actually goes out. Retries are
+    # handled by the shared provider limiter, not per client.
+    @property
+    def client(self):
+        if self._client is None:
+            from groq import Groq
+            self._client = Groq(api_key=self.api_key, max_retries=0)
+        return self._client
+
+    def _create_async_client(self):
+        from groq import AsyncGroq
+        return AsyncGroq(api_key=self.api_key, max_retries=0)
+
+    def _request(self, prompt):
+        return {
+            "messages": [{"role": "user", "content": prompt}],
+            "model": self.model,
+            "response_format": {"type": "json_object"},
+        }
+
+    def complete(self, prompt):
+        chat_completion = self.limiter.call_sync(self.client.chat.completions.create, **self._request(prompt))
+        record_usage(self.model, chat_completion.usage)
+        return chat_completion.choices[0].message.content
+
+    async def complete_async(self, prompt):
+        chat_completion = await self.limiter.call(self.async_clients.get().chat.completions.create, **self._request(prompt))
+        record_usage(self.model, chat_completion.usage)
+        return chat_completion.choices[0].message.content
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, model="gemini-pro"):
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        self.model_name = model
+        self._model = None
+        self.limiter = get_limiter("gemini")
+
+    @property
+    def model(self):
+        # google.generativeai pulls in grpc and protobuf; it is only imported for a real request.
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def _text(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_usage(self.model_name, SimpleNamespace(
+                prompt_tokens=getattr(usage, "prompt_token_count", 0),
+                completion_tokens=getattr(usage, "candidates_token_count", 0),
+            ))
+        # Gemini tends to wrap JSON in a markdown fence; callers expect bare JSON like Groq's.
+        return _JSON_FENCE.sub("", response.text)
+
+    def complete(self, prompt):
+        return self._text(self.limiter.call_sync(self.model.generate_content, prompt))
+
+    async def complete_async(self, prompt):
+        return self._text(await self.limiter.call(self.model.generate_content_async, prompt))
+
+
+BACKENDS = {"groq": GroqBackend, "gemini": GeminiBackend}
+
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20, default=None, floor=0.5):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default = default or float(os.getenv("LLM_HEDGE_DELAY", "5"))
+        self.floor = floor
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        # Until there are enough samples the configured default stands in for the percentile.
+        if len(self.samples) < self.min_samples:
+            return self.default
+        ordered = sorted(self.samples)
+        return max(self.floor, ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))])
+
+
+class CircuitBreaker:
+    # Opens when at least failure_threshold of the last window calls failed and the error rate is
+    # at least error_rate. After cooldown seconds calls are let through again; the next failure
+    # reopens it, the next success closes it.
+    def __init__(self, window=20, failure_threshold=5, error_rate=0.5, cooldown=None):
+        self.results = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.cooldown = cooldown or float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if not self.open_until:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def allow(self):
+        return self.state != "open"
+
+    def record(self, success):
+        with self._lock:
+            half_open = self.state == "half_open"
+            self.results.append(success)
+            if success and half_open:
+                self.open_until = 0.0
+                self.results.clear()
+                return
+            failures = self.results.count(False)
+            if not success and (half_open or (
+                    failures >= self.failure_threshold and failures / len(self.results) >= self.error_rate)):
+                self.open_until = time.monotonic() + self.cooldown
+
+
+class RoutedBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.errors = 0
+
+
+class LLMRouter:
+    # Sends each prompt to the first healthy backend. If it has not answered by its own p95
+    # latency, the prompt is also sent to the next backend and the first answer wins (a hedged
+    # request); if it fails, the next backend is tried straight away (failover).
+    def __init__(self, backends):
+        self.backends = [RoutedBackend(backend) for backend in backends]
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def _candidates(self):
+        healthy = [backend for backend in self.backends if backend.breaker.allow()]
+        # With every breaker open, trying anyway beats failing every request until a cooldown ends.
+        return healthy or list(self.backends)
+
+    def _record(self, routed, started, error=None):
+        routed.calls += 1
+        if error is None:
+            routed.latency.observe(time.perf_counter() - started)
+            routed.breaker.record(True)
+        else:
+            routed.errors += 1
+            routed.breaker.record(False)
+
+    async def _call(self, routed, prompt):
+        started = time.perf_counter()
+        try:
+            result = await routed.backend.complete_async(prompt)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record(routed, started, e)
+            raise
+        self._record(routed, started)
+        return result
+
+    async def complete_async(self, prompt):
+        candidates = self._candidates()
+        primary = candidates.pop(0)
+        tasks = {asyncio.ensure_future(self._call(primary, prompt)): primary}
+        hedged = False
+        error = None
+        try:
+            while tasks:
+                can_hedge = not hedged and candidates and len(tasks) == 1
+                done, _ = await asyncio.wait(
+                    tasks, timeout=primary.latency.p95() if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    self.hedges += 1
+                    backend = candidates.pop(0)
+                    tasks[asyncio.ensure_future(self._call(backend, prompt))] = backend
+                    continue
+                for task in done:
+                    routed = tasks.pop(task)
+                    if task.exception() is None:
+                        if routed is not primary and hedged:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                    if not isinstance(error, Exception):
+                        # Not a provider failure (a replay miss); another backend will not help.
+                        raise error
+                if not tasks and candidates:
+                    self.failovers += 1
+                    backend = candidates.pop(0)
+                    print(f"LLM backend failed ({type(error).__name__}), failing over to {backend.name}")
+                    tasks[asyncio.ensure_future(self._call(backend, prompt))] = backend
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def complete(self, prompt):
+        # The sync path has no hedging (it would need a thread per request), only failover.
+        error = None
+        for index, routed in enumerate(self._candidates()):
+            if index:
+                self.failovers += 1
+                print(f"LLM backend failed ({type(error).__name__}), failing over to {routed.name}")
+            started = time.perf_counter()
+            try:
+                result = routed.backend.complete(prompt)
+            except Exception as e:
+                self._record(routed, started, e)
+                error = e
+                continue
+            self._record(routed, started)
+            return result
+        raise error
+
+    def stats(self):
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "backends": {
+                routed.name: {
+                    "calls": routed.calls,
+                    "errors": routed.errors,
+                    "p95_seconds": round(routed.latency.p95(), 3),
+                    "breaker": routed.breaker.state,
+                }
+                for routed in self.backends
+            },
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_llm_router():
+    # LLM_BACKENDS lists backends in order of preference, e.g. "groq,gemini" to hedge and fail
+    # over to Gemini. The default keeps the pipeline on Groq alone.
+    global _router
+    with _router_lock:
+        if _router is None:
+            names = [name.strip() for name in os.getenv("LLM_BACKENDS", "groq").split(",") if name.strip()]
+            _router = LLMRouter([BACKENDS[name]() for name in names])
+        return _router
+
+
+def router_stats():
+    return _router.stats() if _router is not None else {}
+
+if __name__ == '__main__':
+    router = get_llm_router()
+    prompt = """Return a JSON object with the probability that this text is about a windsurf school.
+    Input text: Windsurf lessons and board rental in Costa Teguise."""
+    print(router.complete(prompt))
+    print(asyncio.run(router.complete_async(prompt)))
+    print(router.stats())
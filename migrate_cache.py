@@ -0,0 +1,11 @@
+import sys
+from cache import migrate_json_cache
+
+if __name__ == '__main__':
+    cache_dir = sys.argv[1] if len(sys.argv) > 1 else "cache"
+    imported = migrate_json_cache(cache_dir)
+    for tool, count in imported.items():
+        print(f"Imported {count} entries for {tool}")
+    print(f"Done. Set CACHE_BACKEND=sqlite to use {cache_dir}/cache.sqlite3")
+    print("Only finder area results and site searches are still read under their old keys; the other "
+          "entries were stored under lossy keys that are no longer used and can be deleted.")
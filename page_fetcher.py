@@ -0,0 +1,114 @@
+import asyncio
+import codecs
+import os
+import re
+import zlib
+from http_session import get_http_session
+
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+
+
+def _decompressor(content_encoding):
+    encoding = (content_encoding or "").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding in ("", "identity"):
+        return None
+    raise ValueError(f"unsupported content encoding {encoding}")
+
+
+def _charset(response, head):
+    if response.charset:
+        return response.charset
+    match = _META_CHARSET.search(head[:4096])
+    return match.group(1).decode("ascii") if match else "utf-8"
+
+
+class PageFetcher:
+    # Streams a page into a bounded buffer: the content type and length are checked from the
+    # headers before any body is read, the body is decompressed chunk by chunk with a cap on the
+    # decompressed size, and reading stops at the byte cap or the deadline with what has arrived.
+    def __init__(self, max_bytes=None, deadline=None, chunk_bytes=64 * 1024):
+        self.max_bytes = max_bytes or int(os.getenv("FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+        self.deadline = deadline or float(os.getenv("FETCH_DEADLINE", "20"))
+        self.chunk_bytes = chunk_bytes
+
+    async def fetch(self, url, headers=None):
+        # Returns a dict with status, headers, html (None for 304 or skipped content), skipped
+        # (the reason a body was not read) and truncated. HTTP errors raise like raise_for_status.
+        request_headers = {"Accept": "text/html,application/xhtml+xml;q=0.9,text/plain;q=0.8",
+                           "Accept-Encoding": "gzip, deflate"}
+        request_headers.update(headers or {})
+        async with get_http_session().get(url, headers=request_headers, auto_decompress=False) as response:
+            page = {"status": response.status, "headers": response.headers, "html": None, "skipped": None, "truncated": False}
+            if response.status == 304:
+                return page
+            response.raise_for_status()
+            if "Content-Type" in response.headers and response.content_type not in TEXT_CONTENT_TYPES:
+                page["skipped"] = f"content type {response.content_type}"
+                return page
+            if (response.content_length or 0) > 8 * self.max_bytes:
+                # A declared size this far past the cap is a download or a data dump, not a page.
+                page["skipped"] = f"content length {response.content_length}"
+                return page
+            try:
+                decompressor = _decompressor(response.headers.get("Content-Encoding"))
+            except ValueError as e:
+                page["skipped"] = str(e)
+                return page
+            body, page["truncated"] = await self._read(response, decompressor)
+            page["html"] = self._decode(response, body)
+            return page
+
+    async def _read(self, response, decompressor):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        body = bytearray()
+        while len(body) < self.max_bytes:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                if not body:
+                    raise asyncio.TimeoutError(f"no body within {self.deadline}s")
+                return body, True
+            try:
+                chunk = await asyncio.wait_for(response.content.read(self.chunk_bytes), remaining)
+            except asyncio.TimeoutError:
+                if not body:
+                    raise
+                return body, True
+            if not chunk:
+                if decompressor is not None:
+                    body.extend(decompressor.flush()[:self.max_bytes - len(body)])
+                return body, False
+            if decompressor is not None:
+                # max_length bounds the output of a single chunk, so a compression bomb cannot
+                # expand past the cap before the length check.
+                chunk = decompressor.decompress(chunk, self.max_bytes - len(body) + 1)
+            body.extend(chunk)
+        del body[self.max_bytes:]
+        return body, True
+
+    @staticmethod
+    def _decode(response, body):
+        charset = _charset(response, bytes(body[:4096]))
+        try:
+            decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # final=False drops a multi-byte character cut in half by the byte cap instead of failing.
+        return decoder.decode(bytes(body), final=False)
+
+if __name__ == '__main__':
+    from http_session import close_http_session
+
+    async def _demo():
+        try:
+            page = await PageFetcher(max_bytes=64 * 1024).fetch("https://example.com/")
+            print(page["status"], page["skipped"], page["truncated"], len(page["html"] or ""))
+        finally:
+            await close_http_session()
+
+    asyncio.run(_demo())
@@ -0,0 +1,232 @@
+import os
+import re
+
+NON_CONTENT_TAGS = ["script", "style", "noscript", "template", "svg", "iframe"]
+BOILERPLATE_TAGS = NON_CONTENT_TAGS + ["nav", "aside"]
+# Matched against whole id and class tokens, so "cookie-banner" or "share-buttons" go but
+# "hero-banner", "form1" or a "cookies-not-set" body class do not.
+BOILERPLATE_MARKERS = re.compile(
+    r"^(?:cookies?|consent|gdpr)(?:[-_][a-z]+)*$|"
+    r"^(?:newsletter|popup|modal|breadcrumbs?|share|sharing|social)"
+    r"(?:[-_](?:bar|box|buttons?|links?|icons?|signup|popup|overlay|dialog|wrapper|container|nav))*$",
+    re.I,
+)
+# The document itself is never removed, whatever its classes say.
+PROTECTED_TAGS = {"html", "body", "main"}
+# If stripping leaves less than this share of the page's text, the page is kept unstripped.
+MIN_KEPT_RATIO = 0.1
+
+PRICE_PATTERN = re.compile(r"[€$£]\s?\d|\d[\d.,]*\s?(?:€|eur\b|euros?\b|usd\b|gbp\b|\$|£)", re.I)
+PHONE_PATTERN = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+KEYWORDS = {
+    "windsurf", "windsurfing", "surf", "course", "courses", "lesson", "lessons", "rental", "rent", "hire",
+    "beginner", "advanced", "price", "prices", "rate", "rates", "hour", "hourly", "day", "daily", "week",
+    "package", "insurance", "pickup", "transfer", "airport", "contact", "address", "phone", "email", "booking",
+}
+SCHEMA_STOPWORDS = {"information", "comments", "details", "included", "availability", "options", "from", "center"}
+_WORD = re.compile(r"[a-z]+")
+
+_encoding = None
+
+
+def _is_boilerplate(tag_name, id_value, class_value):
+    if tag_name in PROTECTED_TAGS:
+        return False
+    tokens = ((id_value or "") + " " + (class_value or "")).split()
+    return any(BOILERPLATE_MARKERS.match(token) for token in tokens)
+
+
+def _keep_or_fallback(text, full_text):
+    if full_text and len(text) < MIN_KEPT_RATIO * len(full_text):
+        print(f"    - Boilerplate stripping removed {len(full_text) - len(text)} of {len(full_text)} characters, keeping the full text")
+        return full_text
+    return text
+
+
+def available_parser(preferred=None):
+    # "auto" picks the fastest installed backend; selectolax and lxml are optional dependencies.
+    preferred = preferred or os.getenv("HTML_PARSER", "auto")
+    candidates = ["selectolax", "lxml", "html.parser"] if preferred == "auto" else [preferred, "html.parser"]
+    for parser in candidates:
+        try:
+            if parser == "selectolax":
+                import selectolax.lexbor  # noqa: F401
+            elif parser == "lxml":
+                import lxml  # noqa: F401
+            return parser
+        except ImportError:
+            continue
+    return "html.parser"
+
+
+def _selectolax_to_text(html):
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(html)
+    if tree.root is None:
+        return ""
+    tree.strip_tags(NON_CONTENT_TAGS)
+    full_text = tree.root.text(separator='\n', strip=True)
+    tree.strip_tags(BOILERPLATE_TAGS)
+    for node in tree.css("footer"):
+        footer_text = node.text(separator=' ')
+        if not (PHONE_PATTERN.search(footer_text) or EMAIL_PATTERN.search(footer_text)):
+            node.decompose()
+    marked = [
+        node for node in tree.css("[id], [class]")
+        if _is_boilerplate(node.tag, node.attributes.get("id"), node.attributes.get("class"))
+    ]
+    # Only remove the outermost marked nodes; their descendants go with them.
+    marked_ids = {node.mem_id for node in marked}
+    for node in marked:
+        parent = node.parent
+        while parent is not None and parent.mem_id not in marked_ids:
+            parent = parent.parent
+        if parent is None:
+            node.decompose()
+    return _keep_or_fallback(tree.root.text(separator='\n', strip=True), full_text)
+
+
+def html_to_text(html, parser="html.parser"):
+    from bs4 import BeautifulSoup
+    if parser == "selectolax":
+        return _selectolax_to_text(html)
+    soup = BeautifulSoup(html, parser)
+    for tag in soup(NON_CONTENT_TAGS):
+        tag.decompose()
+    full_text = soup.get_text(separator='\n', strip=True)
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    for tag in soup("footer"):
+        # Footers are boilerplate except for the contact details schools often only list there.
+        footer_text = tag.get_text(separator=' ')
+        if not (PHONE_PATTERN.search(footer_text) or EMAIL_PATTERN.search(footer_text)):
+            tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed:
+            continue
+        if _is_boilerplate(tag.name, tag.get("id"), " ".join(tag.get("class") or [])):
+            tag.decompose()
+    # Keep block boundaries as newlines so the reducer can chunk on them.
+    return _keep_or_fallback(soup.get_text(separator='\n', strip=True), full_text)
+
+
+def _schema_keywords(schema):
+    keywords = set()
+    if isinstance(schema, dict):
+        for key, value in schema.items():
+            keywords.update(word for word in key.split("_") if len(word) > 3 and word not in SCHEMA_STOPWORDS)
+            keywords.update(_schema_keywords(value))
+    elif isinstance(schema, list):
+        for value in schema:
+            keywords.update(_schema_keywords(value))
+    return keywords
+
+
+def count_tokens(text):
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken unavailable, estimating tokens from length: {e}")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class PageReducer:
+    def __init__(self, token_budget=None, chunk_tokens=300, max_segments=None):
+        self.token_budget = token_budget or int(os.getenv("EXTRACTION_TOKEN_BUDGET", "3000"))
+        self.chunk_tokens = chunk_tokens
+        self.max_segments = max_segments or int(os.getenv("EXTRACTION_MAX_SEGMENTS", "4"))
+
+    def chunk(self, text):
+        chunks = []
+        current = []
+        current_tokens = 0
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            line_tokens = count_tokens(line)
+            if line_tokens > self.chunk_tokens:
+                words = line.split()
+                step = max(1, len(words) * self.chunk_tokens // line_tokens)
+                pieces = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+            else:
+                pieces = [line]
+            for piece in pieces:
+                piece_tokens = count_tokens(piece) if len(pieces) > 1 else line_tokens
+                if current and current_tokens + piece_tokens > self.chunk_tokens:
+                    chunks.append((" ".join(current), current_tokens))
+                    current = []
+                    current_tokens = 0
+                current.append(piece)
+                current_tokens += piece_tokens
+        if current:
+            chunks.append((" ".join(current), current_tokens))
+        return chunks
+
+    def score(self, chunk, schema_keywords):
+        words = _WORD.findall(chunk.lower())
+        keyword_hits = sum(1 for word in words if word in KEYWORDS or word in schema_keywords)
+        return (
+            3 * len(PRICE_PATTERN.findall(chunk))
+            + 2 * len(PHONE_PATTERN.findall(chunk))
+            + 2 * len(EMAIL_PATTERN.findall(chunk))
+            + keyword_hits
+        )
+
+    def segments(self, text, schema):
+        # Returns the prompt texts to extract from: one segment when the relevant content fits the
+        # budget, otherwise up to max_segments budget-sized segments for map-reduce extraction.
+        if count_tokens(text) <= self.token_budget:
+            return [text]
+        schema_keywords = _schema_keywords(schema)
+        chunks = self.chunk(text)
+        scores = [self.score(chunk, schema_keywords) for chunk, _ in chunks]
+        has_relevant = any(scores)
+        total_budget = self.token_budget * self.max_segments if has_relevant else self.token_budget
+
+        selected = []
+        used_tokens = 0
+        for index in sorted(range(len(chunks)), key=lambda i: (-scores[i], i)):
+            if scores[index] == 0 and has_relevant:
+                break
+            chunk_tokens = chunks[index][1]
+            if used_tokens + chunk_tokens > total_budget:
+                continue
+            selected.append(index)
+            used_tokens += chunk_tokens
+
+        segments = []
+        current = []
+        current_tokens = 0
+        for index in sorted(selected):
+            chunk, chunk_tokens = chunks[index]
+            if current and current_tokens + chunk_tokens > self.token_budget:
+                segments.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(chunk)
+            current_tokens += chunk_tokens
+        if current:
+            segments.append("\n".join(current))
+        return segments
+
+if __name__ == '__main__':
+    html = """<html><body><nav>Home | About | Contact</nav>
+    <div class="cookie-banner">We use cookies</div>
+    <h1>Windsurf Center</h1><p>Lorem ipsum dolor sit amet. </p>
+    <h2>Prices</h2><p>Windsurf lesson 1 hour: 45 EUR. Daily rental: 60 €. 5 day package 250 €.</p>
+    <p>Contact: info@example.com, +34 928 123 456</p>
+    <footer>Copyright</footer></body></html>"""
+    text = html_to_text(html)
+    print(text)
+    reducer = PageReducer(token_budget=20, chunk_tokens=10)
+    for segment in reducer.segments(text * 5, {"pricing": {"hourly_rate": None}}):
+        print("---")
+        print(segment)
@@ -0,0 +1,167 @@
+import math
+import os
+import re
+import threading
+import zlib
+from urllib.parse import urlparse
+from cache import Cache
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Path rules for subpages of a school's website. The first matching rule wins; categories not
+# listed get a low probability, so a rule only decides what the page is mainly about.
+SUBPAGE_RULES = [
+    (re.compile(r"/(prices?|pricing|precios?|tarif[a-z]*|preise|rates)(/|\.|$|-)"), {"pricing": 0.95, "courses": 0.5}),
+    (re.compile(r"/(courses?|lessons?|cursos?|clases|kurse|training|school)(/|\.|$|-)"), {"courses": 0.95, "pricing": 0.5}),
+    (re.compile(r"/(camps?|campamentos?|holidays?)(/|\.|$|-)"), {"camps": 0.95, "pricing": 0.4}),
+    (re.compile(r"/(contact[a-z]*|kontakt|find-us|location|ubicacion|where)(/|\.|$|-)"), {"location_information": 0.95, "transport_options": 0.4}),
+    (re.compile(r"/(transfers?|airport|pick-?up|getting-here|how-to-get[a-z-]*)(/|\.|$|-)"), {"transport_options": 0.95, "location_information": 0.5}),
+    (re.compile(r"/(weather|wind|forecast|conditions|spots?)(/|\.|$|-)"), {"weather_conditions": 0.95}),
+    (re.compile(r"/(blog|news|noticias|press|privacy|legal|terms|cookies?|jobs|careers)(/|\.|$|-)"), {"other": 0.95}),
+]
+
+# Domains that never are the school itself: news, travel aggregators, booking portals, social media.
+NON_SCHOOL_DOMAINS = re.compile(
+    r"(^|\.)(booking|tripadvisor|expedia|airbnb|hotels|trivago|getyourguide|viator|civitatis|tiqets|"
+    r"lonelyplanet|wikipedia|facebook|instagram|youtube|tiktok|pinterest|twitter|x|linkedin|reddit|"
+    r"yelp|google|windy|windguru|windfinder|surf-forecast|magicseaweed|canarianweekly|"
+    r"lanzarote-information|holidaycheck|kiteworldwide)\.[a-z.]+$"
+)
+
+
+class HashingModel:
+    # Online logistic regression per category over hashed unigram/bigram features.
+    def __init__(self, categories, n_features=2 ** 16, learning_rate=0.3, weights=None, examples=0):
+        self.categories = categories
+        self.n_features = n_features
+        self.learning_rate = learning_rate
+        self.weights = weights or {category: {} for category in categories}
+        self.examples = examples
+
+    def features(self, text):
+        tokens = _TOKEN.findall(text.lower())
+        grams = tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+        return {zlib.crc32(gram.encode("utf-8")) % self.n_features for gram in grams}
+
+    def predict(self, features):
+        probabilities = {}
+        for category in self.categories:
+            weights = self.weights.setdefault(category, {})
+            score = weights.get(-1, 0.0) + sum(weights.get(feature, 0.0) for feature in features)
+            probabilities[category] = 1 / (1 + math.exp(-max(-30.0, min(30.0, score))))
+        return probabilities
+
+    def learn(self, features, labels):
+        predicted = self.predict(features)
+        for category in self.categories:
+            weights = self.weights[category]
+            gradient = self.learning_rate * (labels.get(category, 0.0) - predicted[category])
+            weights[-1] = weights.get(-1, 0.0) + gradient
+            for feature in features:
+                weights[feature] = weights.get(feature, 0.0) + gradient
+        self.examples += 1
+
+
+class PreClassifier:
+    def __init__(self, name, categories, rules=None, label_threshold=0.5, confidence=None, min_examples=None):
+        self.name = name
+        self.categories = categories
+        self.rules = rules or []
+        self.label_threshold = label_threshold
+        self.confidence = confidence or float(os.getenv("PRECLASSIFIER_CONFIDENCE", "0.9"))
+        self.min_examples = min_examples or int(os.getenv("PRECLASSIFIER_MIN_EXAMPLES", "200"))
+        self.enabled = os.getenv("PRECLASSIFIER_ENABLED", "1") != "0"
+        self.cache = Cache(tool="pre_classifier", memory_tier=False)
+        self.rule_hits = 0
+        self.model_hits = 0
+        self.sent_to_llm = 0
+        self._lock = threading.Lock()
+        saved = self.cache.get(f"model_{name}") or {}
+        self.model = HashingModel(
+            categories,
+            weights={
+                category: {int(feature): weight for feature, weight in weights.items()}
+                for category, weights in saved.get("weights", {}).items()
+            } or None,
+            examples=saved.get("examples", 0),
+        )
+
+    def _text(self, url, title, description):
+        parsed = urlparse(url or "")
+        return f"{parsed.netloc} {parsed.path} {title} {description}"
+
+    def _apply_rules(self, url, title, description):
+        for rule in self.rules:
+            probabilities = rule(url or "", title or "", description or "")
+            if probabilities:
+                return {category: probabilities.get(category, 0.05) for category in self.categories}
+        return None
+
+    def classify(self, url, title, description):
+        # Returns category probabilities when the item is decidable locally, otherwise None.
+        if not self.enabled:
+            return None
+        probabilities = self._apply_rules(url, title, description)
+        if probabilities:
+            with self._lock:
+                self.rule_hits += 1
+            return probabilities
+        with self._lock:
+            if self.model.examples >= self.min_examples:
+                probabilities = self.model.predict(self.model.features(self._text(url, title, description)))
+                if all(p >= self.confidence or p <= 1 - self.confidence for p in probabilities.values()):
+                    self.model_hits += 1
+                    return probabilities
+            self.sent_to_llm += 1
+        return None
+
+    def learn(self, url, title, description, probabilities):
+        labels = {}
+        for category in self.categories:
+            try:
+                labels[category] = 1.0 if float(probabilities.get(category, 0)) > self.label_threshold else 0.0
+            except (TypeError, ValueError):
+                return
+        with self._lock:
+            self.model.learn(self.model.features(self._text(url, title, description)), labels)
+
+    def save(self):
+        with self._lock:
+            self.cache.set(f"model_{self.name}", {
+                "examples": self.model.examples,
+                "weights": {
+                    category: {str(feature): round(weight, 4) for feature, weight in weights.items() if abs(weight) > 1e-4}
+                    for category, weights in self.model.weights.items()
+                },
+            })
+        self.cache.flush()
+
+    def report(self):
+        avoided = self.rule_hits + self.model_hits
+        total = avoided + self.sent_to_llm
+        print(f"Pre-classifier {self.name}: {avoided}/{total} items decided locally "
+              f"({self.rule_hits} by rules, {self.model_hits} by model), {self.sent_to_llm} sent to the LLM")
+
+
+def subpage_rule(url, title, description):
+    path = urlparse(url).path.lower()
+    for pattern, probabilities in SUBPAGE_RULES:
+        if pattern.search(path):
+            return probabilities
+    return None
+
+
+def domain_rule(url, title, description):
+    # Only rejections are safe to decide by rule: "windsurf" in a domain and "center" in its title
+    # fit a magazine or review site as well as a school, so those go to the model or the LLM.
+    domain = urlparse(url).netloc.lower()
+    if NON_SCHOOL_DOMAINS.search(domain):
+        return {"other": 0.95}
+    return None
+
+if __name__ == '__main__':
+    categories = ["location_information", "pricing", "camps", "courses", "weather_conditions", "transport_options", "other"]
+    classifier = PreClassifier("demo", categories, rules=[subpage_rule])
+    for url in ["https://example.com/en/prices/", "https://example.com/contact", "https://example.com/about-us"]:
+        print(url, classifier.classify(url, "", ""))
+    classifier.report()
@@ -0,0 +1,223 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+from async_utils import LoopLocal
+from instrumentation import span
+from record_replay import get_recorder
+
+# Requests per second, bucket size and in-flight requests per provider. Override any value with
+# RATE_LIMIT_<PROVIDER>_RPS, RATE_LIMIT_<PROVIDER>_BURST and RATE_LIMIT_<PROVIDER>_CONCURRENCY.
+# Page fetches get one limiter per host, all configured by the "http" entry.
+DEFAULT_LIMITS = {
+    "groq": {"rps": 0.5, "burst": 5, "concurrency": 5},
+    "tavily": {"rps": 2, "burst": 5, "concurrency": 5},
+    "gemini": {"rps": 1, "burst": 5, "concurrency": 5},
+    "http": {"rps": 2, "burst": 4, "concurrency": 4},
+}
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectError",
+    "ReadTimeout",
+    "ConnectTimeout",
+    "ServerDisconnectedError",
+    "ClientConnectorError",
+    "ClientOSError",
+    "ClientPayloadError",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    # tavily-python raises this for a 429 and drops the status code and headers.
+    "UsageLimitExceededError",
+}
+
+
+def _status_code(error):
+    for attribute in ("status_code", "status", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _headers(error):
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    return headers or {}
+
+
+def retry_after(error):
+    value = _headers(error).get("retry-after") or _headers(error).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+class TokenBucket:
+    def __init__(self, rps, burst):
+        self.rps = rps
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        # Tokens may go negative: each caller reserves its place in line and sleeps until its turn.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rps)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rps if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ProviderLimiter:
+    def __init__(self, name, rps, burst, concurrency, max_retries=5, base_delay=1.0, max_delay=60.0, provider=None):
+        self.name = name
+        self.provider = provider or name
+        self.bucket = TokenBucket(rps, burst)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.failures = 0
+        self._slots = LoopLocal(lambda: asyncio.Semaphore(self.concurrency))
+        self._sync_slots = threading.BoundedSemaphore(concurrency)
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._slots.get():
+            with span(f"ratelimit:{self.provider}", trace=False):
+                await self.bucket.acquire()
+            yield
+
+    @contextmanager
+    def slot_sync(self):
+        with self._sync_slots:
+            with span(f"ratelimit:{self.provider}", trace=False):
+                self.bucket.acquire_sync()
+            yield
+
+    def _retry_delay(self, attempt, error):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            # Retry-After applies to the whole provider, not just this caller.
+            self.bucket.pause(server_delay)
+            delay = max(delay, server_delay)
+        return delay
+
+    def _should_retry(self, attempt, error):
+        if attempt < self.max_retries and is_retryable(error):
+            self.retries += 1
+            return True
+        self.failures += 1
+        return False
+
+    async def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                async with self.slot():
+                    with span(f"provider:{self.provider}", limiter=self.name, attempt=attempt):
+                        return await get_recorder().call(self.provider, func, args, kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self._retry_delay(attempt, e)
+                print(f"{self.name}: {type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def call_sync(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                with self.slot_sync():
+                    with span(f"provider:{self.provider}", limiter=self.name, attempt=attempt):
+                        return get_recorder().call_sync(self.provider, func, args, kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self._retry_delay(attempt, e)
+                print(f"{self.name}: {type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                attempt += 1
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limit_setting(provider, setting, default):
+    value = os.getenv(f"RATE_LIMIT_{provider.upper()}_{setting.upper()}")
+    return type(default)(value) if value else default
+
+
+def get_limiter(name):
+    with _limiters_lock:
+        if name not in _limiters:
+            provider = "http" if name.startswith("host:") else name
+            defaults = DEFAULT_LIMITS[provider]
+            _limiters[name] = ProviderLimiter(
+                name,
+                rps=_limit_setting(provider, "rps", float(defaults["rps"])),
+                burst=_limit_setting(provider, "burst", float(defaults["burst"])),
+                concurrency=_limit_setting(provider, "concurrency", int(defaults["concurrency"])),
+                max_retries=_limit_setting(provider, "max_retries", 5),
+                provider=provider,
+            )
+        return _limiters[name]
+
+
+def host_limiter(url):
+    return get_limiter(f"host:{urlparse(url).netloc}")
+
+if __name__ == '__main__':
+    limiter = get_limiter("groq")
+    started = time.monotonic()
+    for i in range(8):
+        limiter.bucket.acquire_sync()
+        print(f"token {i} after {time.monotonic() - started:.2f}s")
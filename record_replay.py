@@ -0,0 +1,274 @@
+import asyncio
+import atexit
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# PROVIDER_MODE=record writes every provider response (Groq, Gemini, Tavily and page fetches) with
+# its latency to PROVIDER_ARCHIVE; PROVIDER_MODE=replay answers the same requests from that archive
+# without any network, so a production crawl can be re-run offline as a load test.
+# PROVIDER_REPLAY_TIMING is "original", "zero" or a factor applied to the recorded latencies.
+# Replay still goes through the provider limiters, so their scheduling is part of what is measured;
+# the API key checks still apply, any non-empty value will do.
+# Batched LLM prompts are put together in completion order and extraction schemas are pruned by
+# what a domain's other pages already gave, so LLM answers are also recorded per item (see
+# replay_items) and a prompt replay has not seen is answered from those.
+
+_JSON_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_items = contextvars.ContextVar("replay_items", default=None)
+
+
+class ReplayMiss(BaseException):
+    # Not an Exception: callers that treat provider errors as "no answer" must not swallow it, or
+    # a replay silently drops work instead of failing.
+    pass
+
+
+@contextmanager
+def replay_items(items, project=None):
+    # items maps the ids a batched LLM prompt asks about to keys identifying each item on its own;
+    # the id None stands for a single-item prompt whose whole answer belongs to its key. project,
+    # if given, reshapes an item's recorded answer to what this prompt asked for.
+    token = _items.set((items, project))
+    try:
+        yield
+    finally:
+        _items.reset(token)
+
+
+def _attrs(value):
+    # Recorded SDK objects come back with the attribute access the callers use.
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _attrs(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_attrs(item) for item in value]
+    return value
+
+
+def _encode_model(response):
+    return response.model_dump(mode="json") if hasattr(response, "model_dump") else response
+
+
+def _encode_gemini(response):
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": response.text,
+        "usage_metadata": {
+            "prompt_token_count": getattr(usage, "prompt_token_count", 0),
+            "candidates_token_count": getattr(usage, "candidates_token_count", 0),
+        },
+    }
+
+
+def _encode_page(page):
+    return dict(page, headers=list(page["headers"].items()))
+
+
+def _decode_page(page):
+    from multidict import CIMultiDict
+    return dict(page, headers=CIMultiDict(page["headers"]))
+
+
+def _identity(value):
+    return value
+
+
+def _groq_text(response):
+    return response.choices[0].message.content
+
+
+def _groq_response(text):
+    return {"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 0, "completion_tokens": 0}}
+
+
+def _gemini_response(text):
+    return {"text": text, "usage_metadata": {"prompt_token_count": 0, "candidates_token_count": 0}}
+
+
+# (encode, decode) per provider, turning responses into JSON and back.
+CODECS = {
+    "groq": (_encode_model, _attrs),
+    "gemini": (_encode_gemini, _attrs),
+    "tavily": (_identity, _identity),
+    "http": (_encode_page, _decode_page),
+}
+# (text of a response, encoded response for a text) for the LLM providers, to record and replay
+# batched answers per item.
+TEXT_CODECS = {
+    "groq": (_groq_text, _groq_response),
+    "gemini": (lambda response: response.text, _gemini_response),
+}
+
+
+def request_key(provider, func, args, kwargs):
+    # Sync and async variants of a call (generate_content/generate_content_async) share a key.
+    name = getattr(func, "__name__", str(func)).removesuffix("_async")
+    request = json.dumps([provider, name, args, kwargs], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()[:32], name
+
+
+class ProviderRecorder:
+    def __init__(self, mode=None, path=None, timing=None):
+        self.mode = mode or os.getenv("PROVIDER_MODE", "live")
+        if self.mode not in ("live", "record", "replay"):
+            raise ValueError(f"PROVIDER_MODE must be live, record or replay, not {self.mode}")
+        self.path = path or os.getenv("PROVIDER_ARCHIVE", "provider_archive.jsonl.gz")
+        timing = timing or os.getenv("PROVIDER_REPLAY_TIMING", "original")
+        self.scale = {"original": 1.0, "zero": 0.0}.get(timing)
+        if self.scale is None:
+            self.scale = float(timing)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._archive = None
+        self._entries = None
+
+    def _codec(self, provider):
+        return CODECS.get(provider, (_identity, _identity))
+
+    def _write(self, provider, name, key, latency, response):
+        self._append(provider, {
+            "provider": provider,
+            "call": name,
+            "key": key,
+            "latency": round(latency, 4),
+            "response": self._codec(provider)[0](response),
+        })
+        items, _ = _items.get() or (None, None)
+        if items and provider in TEXT_CODECS:
+            self._write_items(provider, items, latency, response)
+
+    def _write_items(self, provider, items, latency, response):
+        try:
+            answer = json.loads(_JSON_FENCE.sub("", TEXT_CODECS[provider][0](response)))
+        except (TypeError, ValueError):
+            return
+        for item_id, item_key in items.items():
+            item_answer = answer if item_id is None else answer.get(item_id) if isinstance(answer, dict) else None
+            if isinstance(item_answer, dict):
+                self._append(provider, {
+                    "provider": provider,
+                    "call": "item",
+                    "key": "item:" + item_key,
+                    "latency": round(latency, 4),
+                    "response": item_answer,
+                })
+
+    def _append(self, provider, entry):
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._archive is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                # Appending adds a gzip member; readers see one stream, so runs can accumulate.
+                self._archive = gzip.open(self.path, "at", encoding="utf-8")
+            self._archive.write(line + "\n")
+            self.stats[f"recorded:{provider}"] += 1
+
+    def _load(self):
+        with self._lock:
+            if self._entries is None:
+                entries = defaultdict(deque)
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        entries[entry["key"]].append(entry)
+                self._entries = entries
+            return self._entries
+
+    @staticmethod
+    def _take(recorded):
+        # Repeated requests get the recorded responses in order, then keep getting the last one.
+        return recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+    def _replay(self, provider, name, key):
+        # Returns (latency, response) for a recorded request, or for a batch whose every item was
+        # recorded, possibly in other batches.
+        entries = self._load()
+        items, project = _items.get() or (None, None)
+        with self._lock:
+            if entries.get(key):
+                self.stats[f"replayed:{provider}"] += 1
+                entry = self._take(entries[key])
+                return entry["latency"], self._codec(provider)[1](entry["response"])
+            if items and provider in TEXT_CODECS and all(entries.get("item:" + item_key) for item_key in items.values()):
+                self.stats[f"replayed_items:{provider}"] += 1
+                answers = {item_id: self._take(entries["item:" + item_key]) for item_id, item_key in items.items()}
+                project = project or _identity
+                if None in answers:
+                    text = json.dumps(project(answers[None]["response"]))
+                else:
+                    text = json.dumps({item_id: project(entry["response"]) for item_id, entry in answers.items()})
+                latency = max(entry["latency"] for entry in answers.values())
+                return latency, self._codec(provider)[1](TEXT_CODECS[provider][1](text))
+            self.stats[f"missed:{provider}"] += 1
+        raise ReplayMiss(f"no recorded {provider} {name} response for this request")
+
+    async def call(self, provider, func, args, kwargs):
+        if self.mode == "live":
+            return await func(*args, **kwargs)
+        key, name = request_key(provider, func, args, kwargs)
+        if self.mode == "replay":
+            latency, response = self._replay(provider, name, key)
+            if self.scale:
+                await asyncio.sleep(latency * self.scale)
+            return response
+        started = time.perf_counter()
+        response = await func(*args, **kwargs)
+        self._write(provider, name, key, time.perf_counter() - started, response)
+        return response
+
+    def call_sync(self, provider, func, args, kwargs):
+        if self.mode == "live":
+            return func(*args, **kwargs)
+        key, name = request_key(provider, func, args, kwargs)
+        if self.mode == "replay":
+            latency, response = self._replay(provider, name, key)
+            if self.scale:
+                time.sleep(latency * self.scale)
+            return response
+        started = time.perf_counter()
+        response = func(*args, **kwargs)
+        self._write(provider, name, key, time.perf_counter() - started, response)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+        if self.stats:
+            print(f"Provider {self.mode}: {json.dumps(dict(self.stats))}")
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = ProviderRecorder()
+            atexit.register(_recorder.close)
+        return _recorder
+
+if __name__ == '__main__':
+    # python record_replay.py [archive]: what an archive holds, per provider and call.
+    path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("PROVIDER_ARCHIVE", "provider_archive.jsonl.gz")
+    calls = Counter()
+    latencies = defaultdict(float)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            calls[(entry["provider"], entry["call"])] += 1
+            latencies[(entry["provider"], entry["call"])] += entry["latency"]
+    for (provider, call), count in sorted(calls.items()):
+        print(f"{provider} {call}: {count} calls, {latencies[(provider, call)] / count:.3f}s average latency")
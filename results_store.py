@@ -0,0 +1,246 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+# A number with optional thousands separators ("1.200", "1,200.50") or decimals ("45,50").
+_AMOUNT = r"\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{1,2})?(?!\d)|\d+(?:[.,]\d{1,2})?(?!\d)"
+_NUMBER = re.compile(_AMOUNT)
+_EUR_AMOUNT = re.compile(rf"(?:€|\beur\b|\beuros?\b)\s*({_AMOUNT})|({_AMOUNT})\s*(?:€|eur\b|euros?\b)", re.I)
+_OTHER_CURRENCY = re.compile(r"[$£]|\b(usd|gbp|dollars?|pounds?)\b", re.I)
+_YES = re.compile(r"^(yes|true|available|included|si|sí|ja|free)\b", re.I)
+_NO = re.compile(r"^(no|false|not|none|unavailable|n/a)\b", re.I)
+
+
+def _to_float(number):
+    # The last separator is the decimal point unless exactly three digits follow it ("1.200 €").
+    *whole, last = re.split(r"[.,]", number)
+    if not whole:
+        return float(last)
+    if len(last) == 3:
+        return float("".join(whole) + last)
+    return float("".join(whole) + "." + last)
+
+
+def parse_price_eur(value):
+    # "45 EUR", "€45", "from 1.200 €", "45,50 euros/day" and plain numbers become floats. The amount
+    # next to the euro sign or word wins ("1 hour: 45 EUR" is 45); other currencies, text without
+    # a number and ambiguous text ("40 € or 70 € with rental", "3 days 150") become None (the raw
+    # value stays in the record column).
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    if _OTHER_CURRENCY.search(value):
+        return None
+    amounts = {_to_float(match.group(1) or match.group(2)) for match in _EUR_AMOUNT.finditer(value)}
+    if not amounts:
+        amounts = {_to_float(number) for number in _NUMBER.findall(value)}
+    return amounts.pop() if len(amounts) == 1 else None
+
+
+def _section(data, key):
+    value = data.get(key)
+    return value if isinstance(value, dict) else {}
+
+
+def _scalar(value):
+    # The LLM sometimes answers with a list or an object where the schema has a string; sqlite
+    # only binds scalars.
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, list) and all(isinstance(item, (str, int, float)) for item in value):
+        return ", ".join(str(item) for item in value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def parse_flag(value):
+    if isinstance(value, bool):
+        return int(value)
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value > 0)
+    if not isinstance(value, str):
+        return None
+    text = str(value).strip()
+    if _NO.search(text):
+        return 0
+    if _YES.search(text) or parse_price_eur(text) is not None:
+        return 1
+    return None
+
+
+class ResultsStore:
+    # Normalized, indexed copy of the aggregated records. The aggregator writes each domain as
+    # soon as it is done; trip-planning queries then run against the indexes instead of
+    # reloading nested JSON.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS schools (
+            domain TEXT PRIMARY KEY,
+            name TEXT,
+            city TEXT,
+            phone TEXT,
+            email TEXT,
+            comments TEXT,
+            record TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS school_regions (
+            region TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            PRIMARY KEY (region, domain)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS pricing (
+            domain TEXT PRIMARY KEY,
+            windsurf_hourly_eur REAL,
+            windsurf_daily_eur REAL,
+            windsurf_package_eur REAL,
+            surf_available INTEGER,
+            surf_hourly_eur REAL,
+            surf_daily_eur REAL,
+            rental_included INTEGER,
+            rental_hourly_eur REAL,
+            rental_daily_eur REAL,
+            insurance_included INTEGER,
+            insurance_daily_eur REAL,
+            comments TEXT
+        );
+        CREATE TABLE IF NOT EXISTS courses (
+            domain TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT,
+            price_eur REAL,
+            details TEXT,
+            PRIMARY KEY (domain, position)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS transport (
+            domain TEXT PRIMARY KEY,
+            pickup_available INTEGER,
+            pickup_cost_eur REAL,
+            from_airport INTEGER,
+            from_city_center INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS school_regions_domain ON school_regions (domain);
+        CREATE INDEX IF NOT EXISTS pricing_windsurf_daily ON pricing (windsurf_daily_eur);
+        CREATE INDEX IF NOT EXISTS pricing_windsurf_hourly ON pricing (windsurf_hourly_eur);
+        CREATE INDEX IF NOT EXISTS pricing_rental_daily ON pricing (rental_daily_eur);
+        CREATE INDEX IF NOT EXISTS courses_price ON courses (price_eur);
+        CREATE INDEX IF NOT EXISTS transport_pickup ON transport (pickup_available, from_airport);
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("RESULTS_DB_PATH", "results.sqlite3")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def add_region(self, region, domain):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO school_regions (region, domain) VALUES (?, ?)", (region, domain))
+            self._conn.commit()
+
+    def write_domain(self, domain, data):
+        location = _section(data, "location_information")
+        contact = _section(location, "contact_details")
+        pricing = _section(data, "pricing")
+        windsurfing = _section(pricing, "windsurfing")
+        surfing = _section(pricing, "surfing")
+        rental = _section(pricing, "equipment_rental")
+        insurance = _section(pricing, "equipment_insurance")
+        pickup = _section(_section(data, "transport_options"), "pickup_service")
+        courses = data.get("courses") if isinstance(data.get("courses"), list) else []
+        courses = [course for course in courses if course]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO schools (domain, name, city, phone, email, comments, record, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (domain, _scalar(location.get("name")), _scalar(location.get("city")), _scalar(contact.get("phone")),
+                 _scalar(contact.get("email")), _scalar(location.get("comments")), json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pricing VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (domain,
+                 parse_price_eur(windsurfing.get("hourly_rate")),
+                 parse_price_eur(windsurfing.get("daily_rate")),
+                 parse_price_eur(windsurfing.get("package_3_to_7_days")),
+                 parse_flag(surfing.get("availability")),
+                 parse_price_eur(surfing.get("hourly_rate")),
+                 parse_price_eur(surfing.get("daily_rate")),
+                 parse_flag(rental.get("included_in_pricing")),
+                 parse_price_eur(rental.get("rental_rate_per_hour")),
+                 parse_price_eur(rental.get("rental_rate_per_day")),
+                 parse_flag(insurance.get("included")),
+                 parse_price_eur(insurance.get("cost_per_day")),
+                 _scalar(pricing.get("comments"))),
+            )
+            self._conn.execute("DELETE FROM courses WHERE domain = ?", (domain,))
+            self._conn.executemany(
+                "INSERT INTO courses (domain, position, name, price_eur, details) VALUES (?, ?, ?, ?, ?)",
+                [(domain, position,
+                  _scalar(course.get("name")) if isinstance(course, dict) else str(course),
+                  parse_price_eur(course.get("price")) if isinstance(course, dict) else None,
+                  json.dumps(course, ensure_ascii=False))
+                 for position, course in enumerate(courses)],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transport VALUES (?, ?, ?, ?, ?)",
+                (domain, parse_flag(pickup.get("availability")), parse_price_eur(pickup.get("cost")),
+                 parse_flag(pickup.get("from_airport")), parse_flag(pickup.get("from_city_center"))),
+            )
+
+    def query(self, region=None, max_daily_price=None, max_hourly_price=None, airport_pickup=None,
+              surfing=None, limit=100):
+        # Schools matching every given filter, cheapest daily windsurf rate first.
+        clauses = []
+        params = []
+        if region is not None:
+            clauses.append("s.domain IN (SELECT domain FROM school_regions WHERE region = ?)")
+            params.append(region)
+        if max_daily_price is not None:
+            clauses.append("p.windsurf_daily_eur <= ?")
+            params.append(max_daily_price)
+        if max_hourly_price is not None:
+            clauses.append("p.windsurf_hourly_eur <= ?")
+            params.append(max_hourly_price)
+        if airport_pickup is not None:
+            clauses.append("t.pickup_available = ? AND t.from_airport = ?" if airport_pickup else "COALESCE(t.pickup_available, 0) = ?")
+            params.extend([1, 1] if airport_pickup else [0])
+        if surfing is not None:
+            clauses.append("p.surf_available = ?")
+            params.append(int(surfing))
+        sql = (
+            "SELECT s.domain, s.name, s.city, s.phone, s.email, p.windsurf_hourly_eur, p.windsurf_daily_eur, "
+            "p.windsurf_package_eur, p.surf_available, t.pickup_available, t.pickup_cost_eur, t.from_airport "
+            "FROM schools s LEFT JOIN pricing p ON p.domain = s.domain LEFT JOIN transport t ON t.domain = s.domain"
+            + (" WHERE " + " AND ".join(clauses) if clauses else "")
+            + " ORDER BY p.windsurf_daily_eur IS NULL, p.windsurf_daily_eur, s.domain LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def record(self, domain):
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM schools WHERE domain = ?", (domain,)).fetchone()
+        return json.loads(row["record"]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+if __name__ == '__main__':
+    # python results_store.py [region] [max daily price]: schools with airport pickup in a region.
+    store = ResultsStore()
+    region = sys.argv[1] if len(sys.argv) > 1 else "Lanzarote"
+    max_daily_price = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for school in store.query(region=region, max_daily_price=max_daily_price, airport_pickup=True):
+        print(json.dumps(school, ensure_ascii=False))
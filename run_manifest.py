@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+DONE = "done"
+EMPTY = "empty"
+FAILED = "failed"
+
+
+def new_run_id(prefix):
+    # One run id per invocation: a later run starts fresh (and gets the caches' TTLs), while an
+    # interrupted run is resumed by passing its id back explicitly.
+    return f"{prefix}:{time.strftime('%Y%m%dT%H%M%S')}:{uuid.uuid4().hex[:6]}"
+
+
+class RunManifest:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS work_items (
+            run_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (run_id, stage, item_key)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, run_id, path=None):
+        self.run_id = run_id
+        self.path = path or os.getenv("RUN_MANIFEST_PATH", os.path.join(os.getenv("CACHE_DIR", "cache"), "run_manifest.sqlite3"))
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def get(self, stage, item_key):
+        # Returns (status, result) for a finished item, or None if it still has to be processed.
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, result FROM work_items WHERE run_id = ? AND stage = ? AND item_key = ?",
+                (self.run_id, stage, item_key),
+            ).fetchone()
+        if row is None or row[0] == FAILED:
+            return None
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    def _mark(self, stage, item_key, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO work_items (run_id, stage, item_key, status, result, error, attempts, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (run_id, stage, item_key) DO UPDATE SET "
+                "status = excluded.status, result = excluded.result, error = excluded.error, "
+                "attempts = attempts + 1, updated_at = excluded.updated_at",
+                (self.run_id, stage, item_key, status,
+                 json.dumps(result, separators=(",", ":")) if result is not None else None,
+                 error, time.time()),
+            )
+            self._conn.commit()
+
+    def done(self, stage, item_key, result):
+        self._mark(stage, item_key, DONE, result)
+
+    def empty(self, stage, item_key):
+        self._mark(stage, item_key, EMPTY)
+
+    def failed(self, stage, item_key, error):
+        self._mark(stage, item_key, FAILED, error=str(error))
+
+    def summary(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, status, COUNT(*) FROM work_items WHERE run_id = ? GROUP BY stage, status ORDER BY stage",
+                (self.run_id,),
+            ).fetchall()
+        summary = {}
+        for stage, status, count in rows:
+            summary.setdefault(stage, {})[status] = count
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM work_items WHERE run_id = ?", (self.run_id,))
+            self._conn.commit()
+
+if __name__ == '__main__':
+    manifest = RunManifest("demo")
+    manifest.done("extract_subpage", "https://example.com/prices", {"pricing": {"hourly_rate": "45 EUR"}})
+    manifest.empty("analyze_domain", "example.org")
+    manifest.failed("extract_subpage", "https://example.com/contact", "timeout")
+    print(manifest.get("extract_subpage", "https://example.com/prices"))
+    print(manifest.get("analyze_domain", "example.org"))
+    print(manifest.get("extract_subpage", "https://example.com/contact"))
+    print(manifest.summary())
+    manifest.reset()
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from async_utils import LoopLocal
+
+
+class SingleFlight:
+    # Concurrent requests for the same key share one in-flight call: the first caller runs it and
+    # everyone who asks for that key before it finishes waits for the same result (or error).
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = LoopLocal(dict)
+        self._sync_inflight = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        # Returns (future, leader). The leader must call settle(key, result) when it is done.
+        inflight = self._inflight.get()
+        future = inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        inflight[key] = future
+        self.calls += 1
+        return future, True
+
+    def settle(self, key, result=None, error=None):
+        future = self._inflight.get().pop(key, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Mark the error as retrieved so it is not logged when nobody was waiting.
+            future.exception()
+        else:
+            future.set_result(result)
+
+    async def do(self, key, func, *args, **kwargs):
+        while True:
+            future, leader = self.claim(key)
+            if leader:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The leader was cancelled, not us: take over the call.
+                    continue
+                raise
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self._inflight.get().pop(key, None)
+            future.cancel()
+            raise
+        except BaseException as e:
+            # Followers get the error too, a ReplayMiss included, instead of waiting forever.
+            self.settle(key, error=e)
+            raise
+        self.settle(key, result)
+        return result
+
+    def do_sync(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._sync_inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._sync_inflight[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._sync_inflight.pop(key, None)
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced}
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_single_flight(name):
+    with _flights_lock:
+        if name not in _flights:
+            _flights[name] = SingleFlight(name)
+        return _flights[name]
+
+
+def single_flight_stats():
+    with _flights_lock:
+        return {name: flight.stats() for name, flight in _flights.items()}
+
+if __name__ == '__main__':
+    flight = get_single_flight("demo")
+
+    async def _slow_lookup(value):
+        await asyncio.sleep(0.1)
+        return value * 2
+
+    async def _demo():
+        return await asyncio.gather(*(flight.do("same-key", _slow_lookup, 21) for _ in range(10)))
+
+    print(asyncio.run(_demo()))
+    print(single_flight_stats())
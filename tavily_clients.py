@@ -0,0 +1,42 @@
+import os
+
+
+def _with_base_url(http_client, base_url):
+    http_client.base_url = base_url
+    return http_client
+
+
+def create_tavily_clients(api_key):
+    from tavily import TavilyClient, AsyncTavilyClient
+    client = TavilyClient(api_key=api_key)
+    async_client = AsyncTavilyClient(api_key=api_key)
+    # TAVILY_BASE_URL points both clients at a compatible endpoint (e.g. the benchmark's fake server).
+    base_url = os.getenv("TAVILY_BASE_URL")
+    if base_url:
+        client.base_url = base_url.rstrip("/")
+        create_http_client = getattr(async_client, "_client_creator", None)
+        if create_http_client is None:
+            raise ValueError("TAVILY_BASE_URL is not supported by the installed tavily-python AsyncTavilyClient")
+        async_client._client_creator = lambda: _with_base_url(create_http_client(), base_url)
+    return client, async_client
+
+
+class TavilyClients:
+    # Creates the sync and async clients on first use, so runs served from cache never import
+    # or construct them.
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self._clients = None
+
+    def _get(self):
+        if self._clients is None:
+            self._clients = create_tavily_clients(self.api_key)
+        return self._clients
+
+    @property
+    def client(self):
+        return self._get()[0]
+
+    @property
+    def async_client(self):
+        return self._get()[1]
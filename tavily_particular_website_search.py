@@ -1,29 +1,74 @@
 import os
-from tavily import TavilyClient
+from tavily_clients import TavilyClients
 from cache import Cache
+from cache_keys import make_cache_key
+from rate_limiter import get_limiter
+from single_flight import get_single_flight
 from dotenv import load_dotenv
-import urllib.parse
 
 load_dotenv()
 
 class TavilyParticularWebsiteSearch:
-    def __init__(self):
+    QUERY = "windsurfing school, rental, camp, pricing, courses, lessons, equipment"
+
+    def __init__(self, include_raw_content=None):
         self.api_key = os.getenv("TAVILY_API_KEY")
         if not self.api_key:
             raise ValueError("TAVILY_API_KEY not found in environment variables")
-        self.client = TavilyClient(api_key=self.api_key)
+        self.clients = TavilyClients(self.api_key)
+        self.limiter = get_limiter("tavily")
+        self.single_flight = get_single_flight("tavily_site_search")
         self.cache = Cache(tool="tavily_particular_website")
+        # With raw content each result also carries the page text, so the aggregator can skip
+        # downloading and parsing the page itself.
+        self.include_raw_content = (
+            include_raw_content if include_raw_content is not None
+            else os.getenv("TAVILY_RAW_CONTENT", "0") not in ("", "0")
+        )
+
+    def _cache_key(self, domain, query, max_results):
+        params = {"raw_content": True} if self.include_raw_content else {}
+        return make_cache_key("site_search", domain, query=query, max_results=max_results, **params)
+
+    def _legacy_key(self, domain, query, max_results):
+        # Entries from before hashed keys had no raw content.
+        return None if self.include_raw_content else f"{domain}_{query}_{max_results}"
 
     def search(self, domain, max_results=10):
-        query = f"windsurfing school, rental, camp, pricing, courses, lessons, equipment"
-        cache_key = f"{domain}_{query}_{max_results}"
-        cached_result = self.cache.get(cache_key)
+        query = self.QUERY
+        cache_key = self._cache_key(domain, query, max_results)
+        cached_result = self.cache.get(cache_key, legacy_key=self._legacy_key(domain, query, max_results))
         if cached_result:
             print(f"Returning cached result for {domain}")
             return cached_result
         
         print(f"Fetching new result for {domain}")
-        response = self.client.search(query, max_results=max_results, include_domains=[domain])
+        return self.single_flight.do_sync(cache_key, self._search_and_cache, cache_key, domain, query, max_results)
+
+    def _search_and_cache(self, cache_key, domain, query, max_results):
+        response = self.limiter.call_sync(
+            self.clients.client.search, query, max_results=max_results, include_domains=[domain],
+            include_raw_content=self.include_raw_content,
+        )
+        self.cache.set(cache_key, response)
+        return response
+
+    async def search_async(self, domain, max_results=10):
+        query = self.QUERY
+        cache_key = self._cache_key(domain, query, max_results)
+        cached_result = self.cache.get(cache_key, legacy_key=self._legacy_key(domain, query, max_results))
+        if cached_result:
+            print(f"Returning cached result for {domain}")
+            return cached_result
+
+        print(f"Fetching new result for {domain}")
+        return await self.single_flight.do(cache_key, self._search_and_cache_async, cache_key, domain, query, max_results)
+
+    async def _search_and_cache_async(self, cache_key, domain, query, max_results):
+        response = await self.limiter.call(
+            self.clients.async_client.search, query, max_results=max_results, include_domains=[domain],
+            include_raw_content=self.include_raw_content,
+        )
         self.cache.set(cache_key, response)
         return response
 
@@ -1,8 +1,10 @@
 import os
-from tavily import TavilyClient
+from tavily_clients import TavilyClients
 from cache import Cache
+from cache_keys import make_cache_key
+from rate_limiter import get_limiter
+from single_flight import get_single_flight
 from dotenv import load_dotenv
-import re
 
 load_dotenv()
 
@@ -11,19 +13,38 @@ class TavilySearch:
         self.api_key = os.getenv("TAVILY_API_KEY")
         if not self.api_key:
             raise ValueError("TAVILY_API_KEY not found in environment variables")
-        self.client = TavilyClient(api_key=self.api_key)
+        self.clients = TavilyClients(self.api_key)
+        self.limiter = get_limiter("tavily")
+        self.single_flight = get_single_flight("tavily_search")
         self.cache = Cache(tool="tavily")
 
     def search(self, query, max_results=10):
-        cache_key_text = ''.join(filter(str.isalnum, query[:50])).lower()
-        cache_key = f"{cache_key_text}_{max_results}"
+        cache_key = make_cache_key("search", query, max_results=max_results)
         cached_result = self.cache.get(cache_key)
         if cached_result:
             print("Returning cached result")
             return cached_result
         
         print("Fetching new result")
-        response = self.client.search(query, max_results=max_results)
+        return self.single_flight.do_sync(cache_key, self._search_and_cache, cache_key, query, max_results)
+
+    def _search_and_cache(self, cache_key, query, max_results):
+        response = self.limiter.call_sync(self.clients.client.search, query, max_results=max_results)
+        self.cache.set(cache_key, response)
+        return response
+
+    async def search_async(self, query, max_results=10):
+        cache_key = make_cache_key("search", query, max_results=max_results)
+        cached_result = self.cache.get(cache_key)
+        if cached_result:
+            print("Returning cached result")
+            return cached_result
+
+        print("Fetching new result")
+        return await self.single_flight.do(cache_key, self._search_and_cache_async, cache_key, query, max_results)
+
+    async def _search_and_cache_async(self, cache_key, query, max_results):
+        response = await self.limiter.call(self.clients.async_client.search, query, max_results=max_results)
         self.cache.set(cache_key, response)
         return response
 
@@ -1,18 +1,52 @@
 import json
-import aiohttp
-from bs4 import BeautifulSoup
+from http_session import close_http_session
+from page_fetcher import PageFetcher
+from rate_limiter import host_limiter
+from page_reducer import PageReducer
+from html_extractor import HtmlExtractor
 from groq_structured_query import GroqStructuredQuery
 from cache import Cache
-from tqdm import tqdm
-from collections import defaultdict
+from cache_keys import make_cache_key, content_hash
+from dedup import ContentClusters, canonicalize_url
+from extraction_schema import MissingFields, sections_for, subschema
+from collections import Counter
 from windsurf_website_analyzer import WindsurfWebsiteAnalyzer
+from async_utils import LoopLocal
+from run_manifest import DONE, RunManifest, new_run_id
+from rate_limiter import RETRYABLE_STATUS_CODES
+from results_store import ResultsStore
+import instrumentation
+from instrumentation import span
 import asyncio
-import re
+import copy
+import os
+import sys
+import time
 
 class WindsurfDataAggregator:
-    def __init__(self):
+    def __init__(self, max_domain_concurrency=None, max_subpage_concurrency=None, manifest=None, refresh=None,
+                 results_store=None):
+        self.manifest = manifest
+        self.results_store = results_store
         self.groq_query = GroqStructuredQuery()
         self.cache = Cache(tool="windsurf_data_aggregator")
+        # ETag, Last-Modified and normalized-text hash of each page as of its last extraction.
+        self.validators = Cache(tool="page_validators", memory_tier=False)
+        # Page text stored by the analyzer from Tavily's raw content; used instead of a live fetch.
+        self.page_content = Cache(tool="page_content")
+        # In refresh mode cached subpages are revalidated against the site instead of being trusted as is.
+        self.refresh = refresh if refresh is not None else os.getenv("AGGREGATOR_REFRESH", "0") not in ("", "0")
+        self.refresh_stats = Counter()
+        self.dedup_stats = Counter()
+        self.schema_stats = Counter()
+        self.content_stats = Counter()
+        self.max_domain_concurrency = max_domain_concurrency or int(os.getenv("AGGREGATOR_DOMAIN_CONCURRENCY", "4"))
+        self.max_subpage_concurrency = max_subpage_concurrency or int(os.getenv("AGGREGATOR_SUBPAGE_CONCURRENCY", "8"))
+        self.domain_slots = LoopLocal(lambda: asyncio.Semaphore(self.max_domain_concurrency))
+        self.subpage_slots = LoopLocal(lambda: asyncio.Semaphore(self.max_subpage_concurrency))
+        self.page_reducer = PageReducer()
+        self.page_fetcher = PageFetcher()
+        self.html_extractor = HtmlExtractor()
         self.structured_output_format = {
             "location_information": {
                 "name": None,
@@ -56,15 +90,55 @@ class WindsurfDataAggregator:
             }
         }
 
-    async def _fetch_text_from_url(self, url):
+    async def _download(self, url, validators=None):
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        return await self.page_fetcher.fetch(url, headers)
+
+    def _stored_page(self, url):
+        stored = self.page_content.get(make_cache_key("page_content", canonicalize_url(url)))
+        if not stored or not stored.get("text"):
+            return None
+        return {"status": 200, "etag": None, "last_modified": None, "skipped": None, "text": stored["text"],
+                "source": stored.get("source")}
+
+    async def _fetch_text_from_url(self, url, validators=None):
+        # Returns a page dict, with text None when the server answered 304 Not Modified or the body
+        # was skipped (see page["skipped"]), or None on error. Outside refresh mode, text stored
+        # from the site search is used when there is any; a refresh always goes to the site.
+        import aiohttp
+        if not self.refresh:
+            page = self._stored_page(url)
+            if page is not None:
+                self.content_stats["stored"] += 1
+                return page
+        self.content_stats["fetched"] += 1
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    html = await response.text()
-                    soup = BeautifulSoup(html, 'html.parser')
-                    text = soup.get_text(separator=' ', strip=True)
-                    return text
+            response = await host_limiter(url).call(self._download, url, validators)
+            page = {
+                "status": response["status"],
+                "etag": response["headers"].get("ETag") or (validators or {}).get("etag"),
+                "last_modified": response["headers"].get("Last-Modified") or (validators or {}).get("last_modified"),
+                "skipped": response["skipped"],
+                "text": None,
+            }
+            if response["truncated"]:
+                print(f"    - Stopped reading {url} at the size or time limit")
+            html = response["html"]
+            if html is not None:
+                with span("parse:html", url=url, bytes=len(html)):
+                    page["text"] = await self.html_extractor.extract(html)
+            return page
+        except aiohttp.ClientResponseError as e:
+            if 400 <= e.status < 500 and e.status not in RETRYABLE_STATUS_CODES:
+                # 404, 410, 403...: the page will not be there on a retry either.
+                return {"status": e.status, "etag": None, "last_modified": None, "skipped": f"HTTP {e.status}", "text": None}
+            print(f"Error fetching URL {url}: {e}")
+            return None
         except aiohttp.ClientError as e:
             print(f"Error fetching URL {url}: {e}")
             return None
@@ -72,74 +146,285 @@ class WindsurfDataAggregator:
             print(f"Error processing URL {url}: {e}")
             return None
 
-    def _extract_data_from_text(self, text):
+    async def _extract_data_from_text(self, text, schema=None):
+        schema = schema or self.structured_output_format
         try:
-            groq_result = self.groq_query.query(text, self.structured_output_format)
+            segments = self.page_reducer.segments(text, schema)
+            if len(segments) == 1:
+                return await self.groq_query.query_async(segments[0], schema)
+
+            # Map-reduce: extract from each budget-sized segment, then merge in page order.
+            print(f"    - Page exceeds token budget, extracting from {len(segments)} segments")
+            segment_results = await asyncio.gather(
+                *(self.groq_query.query_async(segment, schema) for segment in segments)
+            )
+            groq_result = None
+            for segment_result in segment_results:
+                if segment_result:
+                    if groq_result is None:
+                        groq_result = copy.deepcopy(schema)
+                    self._merge_data(groq_result, segment_result)
             return groq_result
         except Exception as e:
             print(f"Error during Groq query: {e}")
             return None
 
-    def _process_subpage(self, url, aggregated_data):
+    async def _process_subpage(self, url, clusters=None, sections=None, missing=None):
+        # sections limits the extraction to the schema sections of the URL's categories; missing
+        # (the domain's MissingFields) further limits it to fields no other subpage has filled yet.
         print(f"  Processing subpage: {url}")
-        cache_key_text = ''.join(filter(str.isalnum, url[:50])).lower()
-        cache_key = f"subpage_content_{cache_key_text}"
+        sections = sections or tuple(self.structured_output_format)
+        full_schema = subschema(self.structured_output_format, sections)
+        cache_key = make_cache_key(
+            "subpage_content",
+            url,
+            model=self.groq_query.model,
+            prompt_version=self.groq_query.PROMPT_VERSION,
+            schema=full_schema,
+        )
         cached_result = self.cache.get(cache_key)
-        if cached_result:
+        if cached_result and not self.refresh:
             print(f"    - Cache hit for {url}")
-            self._merge_data(aggregated_data, cached_result)
-            return
-        
-        text =  asyncio.run(self._fetch_text_from_url(url))
-        if text:
-            extracted_data = self._extract_data_from_text(text)
-            if extracted_data:
+            return cached_result
+        if self.manifest:
+            finished = self.manifest.get("extract_subpage", url)
+            if finished:
+                print(f"    - Already processed {url} in this run")
+                status, result = finished
+                # Empty items finished with nothing to extract; they are not failures.
+                return result if status == DONE else {}
+        if missing is not None and cached_result is None and missing.is_resolved(sections):
+            print(f"    - Every field {url} could provide is already known, skipping it")
+            self.schema_stats["pages_skipped"] += 1
+            return {}
+
+        # Validators are only worth sending when there is a cached extraction to fall back on.
+        validator_key = make_cache_key("page_validators", url)
+        validators = self.validators.get(validator_key) if cached_result else None
+        async with self.subpage_slots.get():
+            page = await self._fetch_text_from_url(url, validators)
+            if page is not None and page["skipped"]:
+                # Not an HTML page (PDF, image, download) or gone (404, 410); nothing to extract
+                # now or on a retry.
+                print(f"    - Skipping {url}: {page['skipped']}")
+                if self.manifest:
+                    self.manifest.empty("extract_subpage", url)
+                return {}
+            if page is None or (page["status"] != 304 and not page["text"]):
+                print(f"    - Could not fetch text from {url}")
+                if self.manifest:
+                    self.manifest.failed("extract_subpage", url, "fetch failed")
+                return None
+            if page["status"] == 304:
+                print(f"    - Not modified since last crawl: {url}")
+                return self._reuse_extraction(url, cached_result, "not_modified")
+            page_hash = content_hash(page["text"])
+            if validators and validators.get("content_hash") == page_hash:
+                self._store_validators(validator_key, page, page_hash)
+                print(f"    - Content unchanged since last crawl: {url}")
+                return self._reuse_extraction(url, cached_result, "unchanged")
+            # Checked again now that the page is here: subpages merged meanwhile may have filled in
+            # more fields.
+            schema = missing.schema_for(sections) if missing is not None else full_schema
+            if schema is None:
+                print(f"    - Every field {url} could provide is already known, skipping it")
+                self.schema_stats["pages_skipped"] += 1
+                return {}
+            extracted_data = await self._extract_once_per_cluster(url, page["text"], clusters, schema)
+        # Only extractions of the full sections are cached (and validated against); a pruned one
+        # depends on what the rest of this run found and would be wrong under the full-schema key.
+        cacheable = schema == full_schema
+        if extracted_data is not None and cacheable and not page.get("source"):
+            # Validators describe the live page; stored search text has its own normalization.
+            self._store_validators(validator_key, page, page_hash)
+            if self.refresh:
+                self.refresh_stats["changed" if validators else "new"] += 1
+        if extracted_data:
+            if cacheable:
                 self.cache.set(cache_key, extracted_data)
-                self._merge_data(aggregated_data, extracted_data)
-                print(f"    - Data extracted and merged from {url}")
-            else:
-                print(f"    - No data extracted from {url}")
+            print(f"    - Data extracted from {url}")
+            if self.manifest:
+                self.manifest.done("extract_subpage", url, extracted_data)
+        elif extracted_data is None:
+            print(f"    - Extraction failed for {url}")
+            if self.manifest:
+                self.manifest.failed("extract_subpage", url, "extraction failed")
         else:
-            print(f"    - Could not fetch text from {url}")
+            print(f"    - No data extracted from {url}")
+            if self.manifest:
+                self.manifest.empty("extract_subpage", url)
+        return extracted_data
+
+    async def _extract_once_per_cluster(self, url, text, clusters, schema=None):
+        duplicate = clusters.join(url, text) if clusters is not None else None
+        if duplicate is not None:
+            representative, extraction = duplicate
+            extracted_data = await asyncio.shield(extraction)
+            if extracted_data is not None:
+                print(f"    - {url} is a near-duplicate of {representative}, reusing its extraction")
+                self.dedup_stats["near_duplicate_pages"] += 1
+                return copy.deepcopy(extracted_data)
+            # The representative failed or was cancelled; extract this copy on its own.
+            return await self._extract_data_from_text(text, schema)
+        extracted_data = None
+        try:
+            extracted_data = await self._extract_data_from_text(text, schema)
+            return extracted_data
+        finally:
+            if clusters is not None:
+                clusters.resolve(url, extracted_data)
+
+    def _store_validators(self, validator_key, page, page_hash):
+        self.validators.set(validator_key, {
+            "etag": page["etag"],
+            "last_modified": page["last_modified"],
+            "content_hash": page_hash,
+            "checked_at": time.time(),
+        })
+
+    def _reuse_extraction(self, url, cached_result, reason):
+        self.refresh_stats[reason] += 1
+        if self.manifest:
+            self.manifest.done("extract_subpage", url, cached_result)
+        return cached_result
 
     def aggregate_data(self, website_analysis):
-        aggregated_results = {}
-        for domain, categories in website_analysis.items():
+        async def _aggregate_and_close():
+            try:
+                return await self.aggregate_data_async(website_analysis)
+            finally:
+                await close_http_session()
+        return asyncio.run(_aggregate_and_close())
+
+    async def aggregate_data_async(self, website_analysis):
+        domains = list(website_analysis.items())
+        results = await asyncio.gather(*(self.aggregate_domain(domain, categories) for domain, categories in domains))
+        self.report()
+        return {domain: result for (domain, _), result in zip(domains, results)}
+
+    async def aggregate_domain(self, domain, categories):
+        if self.manifest:
+            finished = self.manifest.get("aggregate_domain", domain)
+            if finished:
+                print(f"Domain {domain} already aggregated in this run")
+                return finished[1]
+        async with self.domain_slots.get():
             print(f"Aggregating data for domain: {domain}")
-            aggregated_results[domain] = self._aggregate_domain_data(domain, categories)
-        return aggregated_results
+            with span("domain:aggregate", domain=domain):
+                aggregated_data, failed_subpages = await self._aggregate_domain_data(domain, categories)
+        if self.results_store:
+            # The record is still returned (and saved in the manifest) if the indexed copy fails.
+            try:
+                self.results_store.write_domain(domain, aggregated_data)
+            except Exception as e:
+                print(f"Error storing results for {domain}: {e}")
+        if self.manifest:
+            if failed_subpages:
+                self.manifest.failed("aggregate_domain", domain, f"{failed_subpages} subpages failed")
+            else:
+                self.manifest.done("aggregate_domain", domain, aggregated_data)
+        return aggregated_data
 
-    def _aggregate_domain_data(self, domain, categories):
-        aggregated_data = self.structured_output_format.copy()
-        
-        location_complete = False
-        pricing_complete = False
-        
+    def report(self):
+        self.validators.flush()
+        if self.refresh:
+            print(f"Refresh: {json.dumps(dict(self.refresh_stats))}")
+        if self.dedup_stats:
+            print(f"Deduplicated: {json.dumps(dict(self.dedup_stats))}")
+        if self.schema_stats:
+            print(f"Scoped extraction: {json.dumps(dict(self.schema_stats))}")
+        if self.content_stats["stored"]:
+            print(f"Page content: {json.dumps(dict(self.content_stats))}")
+
+    @staticmethod
+    def _location_complete(aggregated_data):
+        location = aggregated_data["location_information"]
+        return bool(location["name"] and location["city"])
+
+    @staticmethod
+    def _pricing_complete(aggregated_data):
+        pricing = aggregated_data["pricing"]
+        return bool(
+            pricing["windsurfing"]["hourly_rate"] and
+            pricing["windsurfing"]["daily_rate"] and
+            pricing["surfing"]["availability"] and
+            pricing["surfing"]["hourly_rate"] and
+            pricing["surfing"]["daily_rate"] and
+            pricing["equipment_rental"]["rental_rate_per_hour"] and
+            pricing["equipment_rental"]["rental_rate_per_day"]
+        )
+
+    async def _aggregate_domain_data(self, domain, categories):
+        aggregated_data = copy.deepcopy(self.structured_output_format)
+        completeness_checks = {
+            "location_information": self._location_complete,
+            "pricing": self._pricing_complete,
+        }
+
+        # Every subpage of the domain starts fetching at once (bounded by subpage_slots), but results
+        # are merged in category/URL order so the record does not depend on network timing. URLs
+        # that canonicalize to the same page share one task, whichever categories list them, and
+        # that task extracts the union of those categories' schema sections in one call.
+        tasks = {}
+        consumers = Counter()
+        first_urls = {}
+        url_categories = {}
         for category, urls in categories.items():
-            print(f" - Processing category: {category}")
             for url in urls:
-                if category == "location_information" and not location_complete:
-                    self._process_subpage(url, aggregated_data)
-                    if aggregated_data["location_information"]["name"] and aggregated_data["location_information"]["city"]:
-                        location_complete = True
-                        print(f"   - Location information complete for {domain}")
-                elif category == "pricing" and not pricing_complete:
-                    self._process_subpage(url, aggregated_data)
-                    if (
-                        aggregated_data["pricing"]["windsurfing"]["hourly_rate"] and
-                        aggregated_data["pricing"]["windsurfing"]["daily_rate"] and
-                        aggregated_data["pricing"]["surfing"]["availability"] and
-                        aggregated_data["pricing"]["surfing"]["hourly_rate"] and
-                        aggregated_data["pricing"]["surfing"]["daily_rate"] and
-                        aggregated_data["pricing"]["equipment_rental"]["rental_rate_per_hour"] and
-                        aggregated_data["pricing"]["equipment_rental"]["rental_rate_per_day"]
-                    ):
-                        pricing_complete = True
-                        print(f"   - Pricing information complete for {domain}")
-                elif category not in ["location_information", "pricing"]:
-                    self._process_subpage(url, aggregated_data)
+                canonical_url = canonicalize_url(url)
+                consumers[canonical_url] += 1
+                if canonical_url in first_urls:
+                    self.dedup_stats["shared_url_fetches"] += 1
+                first_urls.setdefault(canonical_url, url)
+                url_categories.setdefault(canonical_url, []).append(category)
+
+        # Near-duplicate pages only share an extraction when they were asked for the same sections.
+        # missing only learns from pages once they are merged: the merge keeps the first value of a
+        # field, so a field pruned from a later page could never have changed the record, however
+        # the fetches and extractions happen to interleave.
+        clusters = {}
+        missing = MissingFields(self.structured_output_format)
+
+        async def _process(url, sections):
+            return await self._process_subpage(
+                url, clusters.setdefault(sections, ContentClusters()), sections, missing
+            )
+
+        for canonical_url, url in first_urls.items():
+            sections = sections_for(url_categories[canonical_url], self.structured_output_format)
+            tasks[canonical_url] = asyncio.ensure_future(_process(url, sections))
+
+        def _release(urls):
+            for url in urls:
+                canonical_url = canonicalize_url(url)
+                consumers[canonical_url] -= 1
+                if consumers[canonical_url] == 0 and not tasks[canonical_url].done():
+                    tasks[canonical_url].cancel()
+
+        failed_subpages = 0
+        try:
+            for category, urls in categories.items():
+                print(f" - Processing category: {category}")
+                is_complete = completeness_checks.get(category)
+                for index, url in enumerate(urls):
+                    if is_complete and is_complete(aggregated_data):
+                        print(f"   - {category} complete for {domain}, cancelling {len(urls) - index} remaining subpages")
+                        _release(urls[index:])
+                        break
+                    extracted_data = await tasks[canonicalize_url(url)]
+                    _release([url])
+                    if extracted_data is None:
+                        failed_subpages += 1
+                    if extracted_data:
+                        self._merge_data(aggregated_data, extracted_data)
+                        missing.update(extracted_data)
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            self.schema_stats["pruned_fields"] += missing.pruned_fields
         
-        return aggregated_data
+        return aggregated_data, failed_subpages
 
     def _merge_data(self, aggregated_data, new_data):
         def _recursive_merge(agg_data, new_data):
@@ -150,16 +435,38 @@ class WindsurfDataAggregator:
                     else:
                         _recursive_merge(agg_data[key], new_value)
             elif isinstance(agg_data, list) and isinstance(new_data, list):
-                 agg_data.extend(new_data)
+                 agg_data.extend(item for item in new_data if item not in agg_data)
             
         _recursive_merge(aggregated_data, new_data)
 
+async def run_pipeline(area, run_id=None, refresh=False):
+    # Each call is a new run unless run_id names an earlier one to resume; finished and empty
+    # items of a resumed run are skipped.
+    if run_id is None:
+        run_id = new_run_id(f"{area}:refresh" if refresh else area)
+    print(f"Run id: {run_id}")
+    manifest = RunManifest(run_id)
+    results_store = ResultsStore()
+    try:
+        analyzer = WindsurfWebsiteAnalyzer(manifest=manifest)
+        with span("stage:find", area=area):
+            windsurf_finder_results = await analyzer._get_windsurf_finder_results_async(area)
+        for domain in windsurf_finder_results or {}:
+            results_store.add_region(area, domain)
+        with span("stage:analyze", area=area):
+            website_analysis = await analyzer.analyze_websites_async(windsurf_finder_results)
+
+        aggregator = WindsurfDataAggregator(manifest=manifest, refresh=refresh, results_store=results_store)
+        with span("stage:aggregate", area=area):
+            return await aggregator.aggregate_data_async(website_analysis)
+    finally:
+        print(f"Run manifest: {json.dumps(manifest.summary())}")
+        results_store.close()
+        await close_http_session()
+        instrumentation.export()
+
 if __name__ == '__main__':
-    analyzer = WindsurfWebsiteAnalyzer()
     area = "Lanzarote"
-    windsurf_finder_results = analyzer._get_windsurf_finder_results(area)
-    website_analysis = analyzer.analyze_websites(windsurf_finder_results)
-    
-    aggregator = WindsurfDataAggregator()
-    aggregated_data = aggregator.aggregate_data(website_analysis)
+    # Pass --refresh to revalidate cached subpages and re-extract only the ones that changed.
+    aggregated_data = asyncio.run(run_pipeline(area, refresh="--refresh" in sys.argv))
     print(json.dumps(aggregated_data, indent=4))
@@ -1,90 +1,147 @@
-import json
 from tavily_search import TavilySearch
 from urllib.parse import urlparse
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 from groq_query import GroqQuery
 from cache import Cache
-from tqdm import tqdm
+from cache_keys import make_cache_key
+from pre_classifier import PreClassifier, domain_rule
 
 class WindsurfFinder:
-    def __init__(self):
+    CATEGORIES = ["windsurf_rental_or_school", "windsurfing_magazine", "sport_complex", "holiday_center", "other"]
+
+    def __init__(self, manifest=None):
+        self.manifest = manifest
         self.search_tool = TavilySearch()
         self.groq_query = GroqQuery()
         self.cache = Cache(tool="windsurf_finder")
+        self.pre_classifier = PreClassifier("domains", self.CATEGORIES, rules=[domain_rule])
 
     def find_windsurf_locations(self, area):
+        return asyncio.run(self.find_windsurf_locations_async(area))
+
+    async def find_windsurf_locations_async(self, area):
+        return {domain: urls async for domain, urls in self.iter_windsurf_locations(area)}
+
+    async def iter_windsurf_locations(self, area):
+        # Yields (domain, urls) for each accepted domain as soon as it is classified: cached and
+        # locally decided domains first, then each LLM batch as it comes back.
         query = f"windsurf schools or shops in {area}"
-        cache_key = f"all_results_{area}"
-        cached_result = self.cache.get(cache_key)
+        cache_key = make_cache_key("all_results", area)
+        cached_result = self.cache.get(cache_key, legacy_key=f"all_results_{area}")
         if cached_result:
             print("Returning cached windsurf locations")
-            return cached_result
+            for domain, urls in cached_result.items():
+                yield domain, urls
+            return
         
-        results = self.search_tool.search(query, max_results=200)
+        results = await self.search_tool.search_async(query, max_results=200)
         
         if not results or not results.get('results'):
             print("No results found.")
-            return []
+            return
         
         print(f"Found {len(results['results'])} results, analyzing domains...")
-        domains = self._analyze_results(results['results'])
+        domains = {}
+        async for domain, urls in self._analyze_results(results['results']):
+            domains[domain] = urls
+            yield domain, urls
         print(f"Analysis complete, found {len(domains)} domains.")
         self.cache.set(cache_key, domains)
-        return domains
 
-    def _analyze_results(self, results):
+    async def _analyze_results(self, results):
         domains = defaultdict(list)
-        filtered_domains = {}
         for result in results:
             url = result.get('url')
             if url:
                 parsed_url = urlparse(url)
                 domain = parsed_url.netloc
                 domains[domain].append(result)
-        def _process_domain(domain, results):
+        categories = self.CATEGORIES
+
+        candidates = {}
+        pending = {}
+        local = {}
+        for domain, results in domains.items():
             sorted_results = sorted(results, key=lambda x: len(x.get('url', '')))
             first_result = sorted_results[0]
             title = first_result.get('title', '')
             description = first_result.get('description', '')
-            
-            cache_key_title = ''.join(filter(str.isalnum, title[:10])).lower()
+
+            if self.manifest:
+                finished = self.manifest.get("classify_domain", domain)
+                if finished:
+                    status, urls = finished
+                    if urls:
+                        yield domain, urls
+                    continue
+
             query_text = f"{title} {description}"
-            cache_key = f"{domain}_{cache_key_title}"
+            cache_key = make_cache_key(
+                "domain_classification",
+                query_text,
+                model=self.groq_query.model,
+                prompt_version=self.groq_query.PROMPT_VERSION,
+                domain=domain,
+                categories=categories,
+            )
             cached_result = self.cache.get(cache_key)
             if cached_result:
-                return domain, cached_result
-            categories = ["windsurf_rental_or_school", "windsurfing_magazine", "sport_complex", "holiday_center", "other"]
-            
-            try:
-                groq_result = self.groq_query.query(query_text, categories)
-                if groq_result:
-                    groq_result_json = json.loads(groq_result)
-                    windsurf_rental_or_school_probability = groq_result_json.get("windsurf_rental_or_school", 0)
-                    sport_complex_probability = groq_result_json.get("sport_complex", 0)
-                    holiday_center_probability = groq_result_json.get("holiday_center", 0)
+                yield domain, cached_result
+                continue
+            candidates[domain] = (cache_key, sorted_results)
+            local_result = self.pre_classifier.classify(first_result.get('url'), title, description)
+            if local_result:
+                local[domain] = local_result
+            else:
+                pending[domain] = (query_text, first_result)
 
-                    if windsurf_rental_or_school_probability > 0.5 or sport_complex_probability > 0.5 or holiday_center_probability > 0.5:
-                        urls = [res.get('url') for res in sorted_results]
-                        self.cache.set(cache_key, urls)
-                        return domain, urls
-            except Exception as e:
-                print(f"Error processing domain {domain}: {e}")
-            return domain, None
-        
-        async def process_domains_async(domains):
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                loop = asyncio.get_event_loop()
-                tasks = [loop.run_in_executor(executor, _process_domain, domain, results) for domain, results in domains.items()]
-                
-                for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing domains"):
-                    domain, urls = await completed_task
-                    if urls:
-                        filtered_domains[domain] = urls
-        
-        asyncio.run(process_domains_async(domains))
-        return filtered_domains
+        for domain, groq_result_json in local.items():
+            urls = self._accept(domain, groq_result_json, *candidates[domain])
+            if urls:
+                yield domain, urls
+
+        from tqdm import tqdm
+        with tqdm(total=len(pending), desc="Processing domains") as progress:
+            async for domain, groq_result_json in self.groq_query.iter_batch_async(
+                {domain: query_text for domain, (query_text, _) in pending.items()},
+                categories,
+                progress=progress.update,
+            ):
+                if groq_result_json:
+                    first_result = pending[domain][1]
+                    self.pre_classifier.learn(first_result.get('url'), first_result.get('title', ''), first_result.get('description', ''), groq_result_json)
+                urls = self._accept(domain, groq_result_json, *candidates[domain])
+                if urls:
+                    yield domain, urls
+        self.pre_classifier.report()
+        self.pre_classifier.save()
+
+    def _accept(self, domain, groq_result_json, cache_key, sorted_results):
+        # Returns the domain's URLs when its classification makes it a windsurf location.
+        if not groq_result_json:
+            if self.manifest:
+                self.manifest.failed("classify_domain", domain, "no classification")
+            return None
+        try:
+            windsurf_rental_or_school_probability = float(groq_result_json.get("windsurf_rental_or_school", 0))
+            sport_complex_probability = float(groq_result_json.get("sport_complex", 0))
+            holiday_center_probability = float(groq_result_json.get("holiday_center", 0))
+        except (TypeError, ValueError) as e:
+            print(f"Error processing domain {domain}: {e}")
+            if self.manifest:
+                self.manifest.failed("classify_domain", domain, e)
+            return None
+
+        if windsurf_rental_or_school_probability > 0.5 or sport_complex_probability > 0.5 or holiday_center_probability > 0.5:
+            urls = [res.get('url') for res in sorted_results]
+            self.cache.set(cache_key, urls)
+            if self.manifest:
+                self.manifest.done("classify_domain", domain, urls)
+            return urls
+        if self.manifest:
+            self.manifest.empty("classify_domain", domain)
+        return None
 
 if __name__ == '__main__':
     finder = WindsurfFinder()
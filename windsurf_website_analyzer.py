@@ -1,89 +1,159 @@
-import json
 from collections import defaultdict
 from groq_query import GroqQuery
 from cache import Cache
+from cache_keys import make_cache_key
+from dedup import canonicalize_url
+from pre_classifier import PreClassifier, subpage_rule
 from tavily_particular_website_search import TavilyParticularWebsiteSearch
-from tqdm import tqdm
+from instrumentation import span
 from windsurf_finder import WindsurfFinder
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import re
+import os
+import time
 
 class WindsurfWebsiteAnalyzer:
-    def __init__(self):
+    CATEGORIES = ["location_information", "pricing", "camps", "courses", "weather_conditions", "transport_options", "other"]
+
+    def __init__(self, manifest=None):
+        self.manifest = manifest
         self.tavily_website_search = TavilyParticularWebsiteSearch()
         self.groq_query = GroqQuery()
         self.cache = Cache(tool="windsurf_website_analyzer")
+        # Page text Tavily returned with the search (TAVILY_RAW_CONTENT=1), read by the aggregator.
+        self.page_content = Cache(tool="page_content")
+        self.min_page_content_chars = int(os.getenv("PAGE_CONTENT_MIN_CHARS", "200"))
+        self.pre_classifier = PreClassifier("subpages", self.CATEGORIES, rules=[subpage_rule], label_threshold=0.3)
 
     def analyze_websites(self, windsurf_finder_results):
+        return asyncio.run(self.analyze_websites_async(windsurf_finder_results))
+
+    async def analyze_websites_async(self, windsurf_finder_results):
         if not windsurf_finder_results:
             print("No windsurf finder results provided.")
             return {}
+        from tqdm import tqdm
         all_results = {}
         
-        async def process_domains_async(domains):
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                loop = asyncio.get_event_loop()
-                tasks = [loop.run_in_executor(executor, self._process_domain, domain, urls) for domain, urls in domains.items()]
-                
-                for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Analyzing websites"):
-                    domain, subpage_results = await completed_task
-                    if subpage_results:
-                        all_results[domain] = subpage_results
-        
-        asyncio.run(process_domains_async(windsurf_finder_results))
+        tasks = [self._process_domain(domain, urls) for domain, urls in windsurf_finder_results.items()]
+        for completed_task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Analyzing websites"):
+            domain, subpage_results = await completed_task
+            if subpage_results:
+                all_results[domain] = subpage_results
+        self.pre_classifier.report()
+        self.pre_classifier.save()
         return all_results
 
 
-    def _process_domain(self, domain, urls):
+    async def _process_domain(self, domain, urls):
         print(f"Processing domain: {domain}")
-        cache_key_text = ''.join(filter(str.isalnum, domain[:50])).lower()
-        cache_key = f"website_analysis_{cache_key_text}"
+        if self.manifest:
+            finished = self.manifest.get("analyze_domain", domain)
+            if finished:
+                status, subpage_results = finished
+                return domain, subpage_results or {}
+        cache_key = make_cache_key("website_analysis", domain)
         cached_result = self.cache.get(cache_key)
         if cached_result:
             print(f"  - Returning cached analysis for {domain}")
             return domain, cached_result
         
-        tavily_results = self.tavily_website_search.search(domain)
-        if not tavily_results or not tavily_results.get('results'):
-            print(f"  - No Tavily results found for domain: {domain}")
-            return domain, {}
-        
-        subpage_results = self._categorize_subpages(domain, tavily_results['results'])
+        with span("domain:analyze", domain=domain):
+            tavily_results = await self.tavily_website_search.search_async(domain)
+            if not tavily_results or not tavily_results.get('results'):
+                print(f"  - No Tavily results found for domain: {domain}")
+                if self.manifest:
+                    self.manifest.empty("analyze_domain", domain)
+                return domain, {}
+
+            self._store_page_content(tavily_results['results'])
+            subpage_results = await self._categorize_subpages(domain, tavily_results['results'])
         self.cache.set(cache_key, subpage_results)
+        if self.manifest:
+            if subpage_results:
+                self.manifest.done("analyze_domain", domain, subpage_results)
+            else:
+                self.manifest.empty("analyze_domain", domain)
         return domain, subpage_results
 
-    def _categorize_subpages(self, domain, results):
-        categories = ["location_information", "pricing", "camps", "courses", "weather_conditions", "transport_options", "other"]
-        subpage_results = defaultdict(list)
-        for result in tqdm(results, desc=f"  - Categorizing subpages for {domain}"):
+    def _store_page_content(self, results):
+        for result in results:
+            text = result.get('raw_content')
+            # Very short raw content is usually a cookie wall or a JS shell; the live page is better.
+            if result.get('url') and text and len(text) >= self.min_page_content_chars:
+                self.page_content.set(make_cache_key("page_content", canonicalize_url(result['url'])), {
+                    "text": text,
+                    "source": "tavily",
+                    "stored_at": time.time(),
+                })
+
+    async def _categorize_subpages(self, domain, results):
+        categories = self.CATEGORIES
+        classifications = {}
+        pending = {}
+        seen_urls = set()
+        for index, result in enumerate(results):
             url = result.get('url')
             title = result.get('title', '')
             description = result.get('description', '')
+            # Language, tracking and print variants of a page are classified (and later fetched) once.
+            canonical_url = canonicalize_url(url) if url else None
+            if canonical_url in seen_urls:
+                continue
+            seen_urls.add(canonical_url)
             if url:
-                cache_key_title = ''.join(filter(str.isalnum, title[:10])).lower()
                 query_text = f"{title} {description}"
-                cache_key_text = ''.join(filter(str.isalnum, query_text[:50])).lower()
-                cache_key = f"{domain}_{cache_key_text}"
+                cache_key = make_cache_key(
+                    "subpage_classification",
+                    query_text,
+                    model=self.groq_query.model,
+                    prompt_version=self.groq_query.PROMPT_VERSION,
+                    domain=domain,
+                    categories=categories,
+                )
                 cached_groq_result = self.cache.get(cache_key)
-                if cached_groq_result:
-                    groq_result_json = cached_groq_result
+                local_result = None if cached_groq_result else self.pre_classifier.classify(url, title, description)
+                if cached_groq_result or local_result:
+                    classifications[index] = cached_groq_result or local_result
                 else:
-                    groq_result = self.groq_query.query(query_text, categories)
-                    if groq_result:
-                        groq_result_json = json.loads(groq_result)
-                        self.cache.set(cache_key, groq_result_json)
-                    else:
-                        continue
-                
-                for category in categories:
-                    if category != "other" and groq_result_json.get(category, 0) > 0.3:
-                        subpage_results[category].append(url)
+                    pending[index] = (query_text, cache_key)
+
+        if pending:
+            print(f"  - Categorizing {len(pending)} subpages for {domain}")
+            groq_results = await self.groq_query.query_batch_async(
+                {index: query_text for index, (query_text, _) in pending.items()},
+                categories,
+            )
+            for index, (_, cache_key) in pending.items():
+                groq_result_json = groq_results.get(index)
+                if groq_result_json:
+                    self.cache.set(cache_key, groq_result_json)
+                    classifications[index] = groq_result_json
+                    result = results[index]
+                    self.pre_classifier.learn(result['url'], result.get('title', ''), result.get('description', ''), groq_result_json)
+
+        subpage_results = defaultdict(list)
+        for index, result in enumerate(results):
+            groq_result_json = classifications.get(index)
+            if not groq_result_json:
+                continue
+            for category in categories:
+                if category != "other" and self._probability(groq_result_json, category) > 0.3:
+                    subpage_results[category].append(result['url'])
         return subpage_results
 
+    @staticmethod
+    def _probability(groq_result_json, category):
+        try:
+            return float(groq_result_json.get(category, 0))
+        except (TypeError, ValueError):
+            return 0.0
+
     def _get_windsurf_finder_results(self, area):
-        finder = WindsurfFinder()
-        return finder.find_windsurf_locations(area)
+        return asyncio.run(self._get_windsurf_finder_results_async(area))
+
+    async def _get_windsurf_finder_results_async(self, area):
+        finder = WindsurfFinder(manifest=self.manifest)
+        return await finder.find_windsurf_locations_async(area)
 
 if __name__ == '__main__':
     analyzer = WindsurfWebsiteAnalyzer()